@@ -0,0 +1,129 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import ADMISSION_ACTIVE, ADMISSION_QUEUED, ADMISSION_REJECTIONS
+
+# Weight of the newest conversion in the running average used for Retry-After
+DURATION_SMOOTHING = 0.2
+MAX_RETRY_AFTER = 300
+
+
+class Overloaded(Exception):
+    # status is 429 when the wait queue is full, 503 when a request waited too long for a slot
+    def __init__(self, kind, status, retry_after):
+        super().__init__(f"Too many {kind} conversions in progress, retry in {retry_after}s")
+        self.kind = kind
+        self.status = status
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimit:
+    # At most `concurrency` conversions of one kind hold a slot at a time, and at most
+    # `queue_size` more wait for one. Queued jobs are started in arrival order as slots
+    # are released; anything beyond the queue is rejected at once instead of piling up.
+
+    def __init__(self, kind, concurrency, queue_size):
+        self.kind = kind
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.average_seconds = 1.0
+        self._active = 0
+        self._waiting = deque()
+        self._lock = threading.Lock()
+        self._update_gauges()
+
+    def _update_gauges(self):
+        ADMISSION_ACTIVE.set(self._active, kind=self.kind)
+        ADMISSION_QUEUED.set(len(self._waiting), kind=self.kind)
+
+    def retry_after(self):
+        # Rough time until the queue ahead has drained
+        rounds = (len(self._waiting) + 1) / self.concurrency
+        return max(1, min(MAX_RETRY_AFTER, math.ceil(self.average_seconds * rounds)))
+
+    def _reject(self, status, reason):
+        ADMISSION_REJECTIONS.inc(kind=self.kind, reason=reason)
+        return Overloaded(self.kind, status, self.retry_after())
+
+    def start_or_queue(self, start, on_error=None):
+        # Call start() now if a slot is free, otherwise once one is released to it. If a
+        # queued start() raises, its slot is released and on_error(exception) is called,
+        # since nobody is left waiting on the call to see the error.
+        with self._lock:
+            if self._active < self.concurrency:
+                self._active += 1
+                run_now = True
+            elif len(self._waiting) < self.queue_size:
+                self._waiting.append((start, on_error))
+                run_now = False
+            else:
+                raise self._reject(429, 'queue_full')
+            self._update_gauges()
+        if run_now:
+            try:
+                start()
+            except BaseException:
+                self.release()
+                raise
+
+    def acquire(self, timeout=None):
+        # Block the calling request until it holds a slot, for at most timeout seconds
+        started = threading.Event()
+        self.start_or_queue(started.set)
+        if started.wait(timeout):
+            return
+        with self._lock:
+            try:
+                self._waiting.remove((started.set, None))
+            except ValueError:
+                # A slot was handed over just as the wait timed out
+                return
+            self._update_gauges()
+        raise self._reject(503, 'timeout')
+
+    def release(self, seconds=None):
+        if seconds is not None:
+            self.average_seconds += DURATION_SMOOTHING * (seconds - self.average_seconds)
+        with self._lock:
+            # The slot passes straight to the next waiter, if there is one
+            start, on_error = self._waiting.popleft() if self._waiting else (None, None)
+            if start is None:
+                self._active -= 1
+            self._update_gauges()
+        if start is not None:
+            try:
+                start()
+            except Exception as e:
+                print(f"Error starting queued {self.kind} conversion: {e}")
+                self.release()
+                if on_error is not None:
+                    on_error(e)
+
+    def cancel_waiting(self, error):
+        # Fail every queued job with error instead of starting it. Requests blocked in
+        # acquire() keep their place; they time out or get a slot as usual.
+        with self._lock:
+            cancelled = [entry for entry in self._waiting if entry[1] is not None]
+            for entry in cancelled:
+                self._waiting.remove(entry)
+            self._update_gauges()
+        for start, on_error in cancelled:
+            on_error(error)
+        return len(cancelled)
+
+    @contextmanager
+    def slot(self, timeout=None):
+        self.acquire(timeout)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+
+def build_limits(config):
+    # {'image': {'concurrency': 4, 'queue_size': 32}, ...} -> {'image': ConcurrencyLimit, ...}
+    return {kind: ConcurrencyLimit(kind, **options) for kind, options in config.items()}
@@ -0,0 +1,82 @@
+import subprocess
+import tempfile
+
+# ffmpeg output options for each target format
+AUDIO_CODECS = {
+    'mp3': ['-f', 'mp3', '-codec:a', 'libmp3lame', '-q:a', '4'],
+    'aac': ['-f', 'adts', '-codec:a', 'aac', '-b:a', '160k'],
+    'm4a': ['-f', 'ipod', '-codec:a', 'aac', '-b:a', '160k'],
+    'mp4': ['-f', 'mp4', '-codec:a', 'aac', '-b:a', '160k'],
+    'opus': ['-f', 'ogg', '-codec:a', 'libopus', '-b:a', '96k'],
+    'ogg': ['-f', 'ogg', '-codec:a', 'libvorbis', '-q:a', '5'],
+    'flac': ['-f', 'flac', '-codec:a', 'flac'],
+    'wav': ['-f', 'wav', '-codec:a', 'pcm_s16le'],
+}
+
+AUDIO_MIMETYPES = {
+    'mp3': 'audio/mpeg',
+    'aac': 'audio/aac',
+    'm4a': 'audio/mp4',
+    'mp4': 'audio/mp4',
+    'opus': 'audio/ogg',
+    'ogg': 'audio/ogg',
+    'flac': 'audio/flac',
+    'wav': 'audio/wav',
+}
+
+# MP4 based containers normally seek back to write their index, which a pipe cannot do
+PIPE_OPTIONS = {
+    'm4a': ['-movflags', 'frag_keyframe+empty_moov'],
+    'mp4': ['-movflags', 'frag_keyframe+empty_moov'],
+}
+
+CHUNK_SIZE = 64 * 1024
+
+
+def ffmpeg_binary():
+    # The same ffmpeg binary pydub has been configured with; pydub is only imported here
+    # so the format tables above can be used without loading it
+    from pydub import AudioSegment
+    return AudioSegment.converter
+
+
+def ffmpeg_command(arguments):
+    # Quiet, non-interactive ffmpeg that overwrites its output and only reports errors
+    return [ffmpeg_binary(), '-nostdin', '-hide_banner', '-loglevel', 'error', '-y', *arguments]
+
+
+def run_ffmpeg(arguments):
+    result = subprocess.run(ffmpeg_command(arguments), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode('utf-8', 'replace').strip() or 'ffmpeg failed')
+
+
+def transcode_arguments(file_path, output_format, output):
+    if output_format not in AUDIO_CODECS:
+        raise ValueError(f"Unsupported audio format: {output_format}")
+    return ['-i', file_path, '-vn', *AUDIO_CODECS[output_format], output]
+
+
+def transcode(file_path, output_path, output_format):
+    # ffmpeg decodes and encodes in small frames, so memory stays constant whatever the track length
+    run_ffmpeg(transcode_arguments(file_path, output_format, output_path))
+
+
+def iter_transcode(file_path, output_format, chunk_size=CHUNK_SIZE):
+    # Yield the encoded output in fixed-size chunks while ffmpeg is still running
+    arguments = transcode_arguments(file_path, output_format, 'pipe:1')
+    arguments[-1:-1] = PIPE_OPTIONS.get(output_format, [])
+    command = ffmpeg_command(arguments)
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            for chunk in iter(lambda: process.stdout.read(chunk_size), b''):
+                yield chunk
+            if process.wait() != 0:
+                stderr.seek(0)
+                raise RuntimeError(stderr.read().decode('utf-8', 'replace').strip() or 'ffmpeg failed')
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+                process.wait()
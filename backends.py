@@ -0,0 +1,67 @@
+import importlib
+import multiprocessing
+import threading
+
+# Converter backends are imported on first use, so a process that only serves pages and
+# downloads never loads OpenCV, PyMuPDF or pydub. Conversion workers can load them all
+# up front with prewarm() (the process pool runs it as its initializer).
+BACKENDS = {}
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def register_backend(name, module, warm=None):
+    # module is the import path of the backend; warm(module), if given, runs once after
+    # the import to do any other slow setup (fonts, codec discovery, ...)
+    BACKENDS[name] = (module, warm)
+
+
+def load_backend(name):
+    module = _loaded.get(name)
+    if module is not None:
+        return module
+    with _lock:
+        if name not in _loaded:
+            module_name, warm = BACKENDS[name]
+            module = importlib.import_module(module_name)
+            if warm is not None:
+                warm(module)
+            _loaded[name] = module
+        return _loaded[name]
+
+
+def prewarm(names=None):
+    # Load the named backends (all of them by default); failures are reported, not raised,
+    # so a missing optional library only affects its own conversions
+    for name in names or list(BACKENDS):
+        try:
+            load_backend(name)
+        except Exception as e:
+            print(f"Error loading backend {name}: {e}")
+
+
+def worker_context():
+    # Start method for process pools. Pools are started lazily from a threaded web process,
+    # and a child forked while another thread held _lock or was half way through an import
+    # would inherit that lock held forever and hang in prewarm(). forkserver children are
+    # forked from a separate single-threaded server instead; spawn where that is missing.
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def _warm_docx(module):
+    module.get_renderer()
+
+
+def _warm_ffmpeg(module):
+    module.ffmpeg_binary()
+
+
+register_backend('opencv', 'cv2')
+register_backend('image', 'image_decode')
+register_backend('pdf', 'pdf_text')
+register_backend('raster', 'pdf_raster')
+register_backend('docx', 'docx_render', warm=_warm_docx)
+register_backend('audio', 'audio_stream', warm=_warm_ffmpeg)
+register_backend('video', 'video_transcode', warm=_warm_ffmpeg)
@@ -0,0 +1,160 @@
+# Deterministic benchmark inputs: a multi-page PDF, a long DOCX, large PNG and JPEG images,
+# a long audio track and a video clip. The same parameters always produce the same files, and a corpus
+# that already matches its parameters is reused rather than generated again.
+#
+#     python benchmarks/corpus.py [--folder benchmarks/corpus] [--pdf-pages 200] ...
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import fitz
+import numpy as np
+
+from docx_writer import DocxWriter
+
+DEFAULT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+DEFAULTS = {
+    'seed': 1234,
+    'pdf_pages': 200,
+    'docx_paragraphs': 3000,
+    'image_megapixels': 24,
+    'audio_seconds': 600,
+    'video_seconds': 120,
+}
+
+WORDS = ('conversion latency throughput page image audio document buffer stream cache worker '
+         'process memory encode decode resize render paragraph format upload download quality').split()
+
+MANIFEST = 'corpus.json'
+
+
+def sentences(rng, count):
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(6, 18))]
+        yield ' '.join(words).capitalize() + '.'
+
+
+def make_pdf(path, pages, rng):
+    document = fitz.open()
+    for number in range(pages):
+        page = document.new_page()
+        text = f'Page {number + 1}\n\n' + '\n\n'.join(
+            ' '.join(sentences(rng, rng.randint(3, 6))) for _ in range(8))
+        page.insert_textbox(page.rect + (54, 54, -54, -54), text, fontsize=10)
+    document.save(path, garbage=3, deflate=True)
+    document.close()
+
+
+def make_docx(path, paragraphs, rng):
+    with DocxWriter(path) as docx:
+        for number in range(paragraphs):
+            docx.add_paragraph(' '.join(sentences(rng, rng.randint(1, 6))))
+            if number and number % 150 == 0:
+                docx.add_page_break()
+
+
+def make_image(megapixels, seed):
+    # Smooth gradients plus a little noise compress like a photo rather than like noise
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[..., 0] = (x + y) / 2
+    image[..., 1] = x
+    image[..., 2] = y
+    image += np.random.default_rng(seed).integers(0, 8, image.shape, dtype=np.uint8)
+    return image
+
+
+def make_audio(wav_path, mp3_path, seconds):
+    # Tone sweep with background noise so the encoders have something to work on
+    from pydub import AudioSegment
+
+    source = (f'aevalsrc=0.4*sin(2*PI*(220+110*sin(t/7))*t)+0.05*(random(0)-0.5)'
+              f':s=44100:c=stereo:d={seconds}')
+    base = [AudioSegment.converter, '-nostdin', '-hide_banner', '-loglevel', 'error', '-y']
+    subprocess.run(base + ['-f', 'lavfi', '-i', source, '-codec:a', 'pcm_s16le', wav_path], check=True)
+    subprocess.run(base + ['-i', wav_path, '-codec:a', 'libmp3lame', '-q:a', '4', mp3_path], check=True)
+
+
+def make_video(path, seconds):
+    # H.264 and AAC in MP4 with a keyframe every two seconds, as a camera or browser would write it
+    from pydub import AudioSegment
+
+    base = [AudioSegment.converter, '-nostdin', '-hide_banner', '-loglevel', 'error', '-y']
+    subprocess.run(base + ['-f', 'lavfi', '-i', f'testsrc2=size=1280x720:rate=30:duration={seconds}',
+                           '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=44100:duration={seconds}',
+                           '-codec:v', 'libx264', '-preset', 'veryfast', '-g', '60', '-pix_fmt', 'yuv420p',
+                           '-codec:a', 'aac', '-b:a', '128k', path], check=True)
+
+
+def build_corpus(folder=DEFAULT_FOLDER, **params):
+    # Returns {name: path}; files are only regenerated when the parameters changed
+    params = dict(DEFAULTS, **{key: value for key, value in params.items() if value is not None})
+    files = {
+        'pdf': os.path.join(folder, 'multipage.pdf'),
+        'docx': os.path.join(folder, 'long.docx'),
+        'png': os.path.join(folder, 'large.png'),
+        'jpeg': os.path.join(folder, 'large.jpeg'),
+        'wav': os.path.join(folder, 'long.wav'),
+        'mp3': os.path.join(folder, 'long.mp3'),
+        'mp4': os.path.join(folder, 'clip.mp4'),
+    }
+    manifest_path = os.path.join(folder, MANIFEST)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+            if json.load(manifest_file) == params and all(os.path.exists(path) for path in files.values()):
+                return files
+    except (OSError, ValueError):
+        pass
+
+    os.makedirs(folder, exist_ok=True)
+    seed = params['seed']
+    make_pdf(files['pdf'], params['pdf_pages'], random.Random(seed))
+    make_docx(files['docx'], params['docx_paragraphs'], random.Random(seed + 1))
+    image = make_image(params['image_megapixels'], seed + 2)
+    cv2.imwrite(files['png'], image)
+    cv2.imwrite(files['jpeg'], image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    del image
+    make_audio(files['wav'], files['mp3'], params['audio_seconds'])
+    make_video(files['mp4'], params['video_seconds'])
+
+    with open(manifest_path, 'w', encoding='utf-8') as manifest_file:
+        json.dump(params, manifest_file, indent=2)
+    return files
+
+
+def add_arguments(parser):
+    parser.add_argument('--corpus', default=DEFAULT_FOLDER, help='folder holding the generated inputs')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--pdf-pages', type=int)
+    parser.add_argument('--docx-paragraphs', type=int)
+    parser.add_argument('--image-megapixels', type=float)
+    parser.add_argument('--audio-seconds', type=int)
+    parser.add_argument('--video-seconds', type=int)
+
+
+def corpus_from_args(args):
+    return build_corpus(args.corpus, seed=args.seed, pdf_pages=args.pdf_pages,
+                        docx_paragraphs=args.docx_paragraphs, image_megapixels=args.image_megapixels,
+                        audio_seconds=args.audio_seconds, video_seconds=args.video_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+    for name, path in corpus_from_args(args).items():
+        print(f'{name:<5} {os.path.getsize(path) / 1e6:8.1f} MB  {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# Per-document DOCX -> PDF latency: built-in fitz renderer (cold and warm) against docx2pdf.
+#
+#     python benchmarks/docx_to_pdf.py [--paragraphs 500] [--runs 10]
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from docx_writer import DocxWriter
+from docx_render import DocxRenderer
+
+SENTENCE = 'The quick brown fox jumps over the lazy dog while the converter keeps working. '
+
+
+def make_docx(path, paragraphs):
+    with DocxWriter(path) as docx:
+        for number in range(paragraphs):
+            docx.add_paragraph(f'{number}. ' + SENTENCE * (1 + number % 6))
+            if number and number % 100 == 0:
+                docx.add_page_break()
+
+
+def measure(label, func, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    print(f'{label:<24} median {statistics.median(timings) * 1000:8.1f} ms   '
+          f'min {min(timings) * 1000:8.1f} ms   runs {runs}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--paragraphs', type=int, default=500)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        docx_path = os.path.join(folder, 'input.docx')
+        pdf_path = os.path.join(folder, 'output.pdf')
+        make_docx(docx_path, args.paragraphs)
+
+        measure('fitz renderer (cold)', lambda: DocxRenderer().render(docx_path, pdf_path), args.runs)
+        warm = DocxRenderer()
+        measure('fitz renderer (warm)', lambda: warm.render(docx_path, pdf_path), args.runs)
+
+        try:
+            import docx2pdf
+            measure('docx2pdf', lambda: docx2pdf.convert(docx_path, pdf_path), args.runs)
+        except Exception as e:
+            print(f'{"docx2pdf":<24} unavailable: {e}')
+
+
+if __name__ == '__main__':
+    main()
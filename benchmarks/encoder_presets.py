@@ -0,0 +1,63 @@
+# Output size against encode time for each encoder preset, on the sample images in
+# uploads/ (or the files given). The download column is the time to send the output
+# over a link of --mbps megabits per second, which is what the "small" preset is for.
+#
+#     python benchmarks/encoder_presets.py [--repeat 5] [--mbps 10] [image ...]
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from encoder_presets import ENCODER_PRESETS
+from image_decode import load_image
+from converters import encode_image
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.gif', '.tif', '.tiff')
+
+
+def sample_images():
+    folder = os.path.join(ROOT, 'uploads')
+    return sorted(path for path in glob.glob(os.path.join(folder, '*'))
+                  if path.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def measure(image, output_format, preset, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        buffer = encode_image(image, output_format, preset=preset)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), len(buffer)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--mbps', type=float, default=10, help='link speed for the download estimate')
+    parser.add_argument('--formats', default='jpeg,png,webp')
+    args = parser.parse_args()
+
+    paths = args.images or sample_images()
+    if not paths:
+        sys.exit('No sample images found')
+
+    presets = [None] + list(ENCODER_PRESETS)
+    for path in paths:
+        image = load_image(path)
+        print(f'{os.path.basename(path)} {image.shape[1]}x{image.shape[0]}')
+        for output_format in args.formats.split(','):
+            for preset in presets:
+                elapsed, size = measure(image, output_format, preset, args.repeat)
+                download = size * 8 / (args.mbps * 1e6)
+                print(f'    {output_format:<5} {preset or "default":<9} {elapsed * 1000:9.1f} ms encode'
+                      f' {size / 1024:10.1f} KiB {download * 1000:9.1f} ms download')
+
+
+if __name__ == '__main__':
+    main()
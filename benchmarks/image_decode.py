@@ -0,0 +1,69 @@
+# Peak memory and latency of convert_image's decode path on large inputs: full-resolution
+# cv2.imread + resize against load_image's reduced/tiled decoding. Each case runs in its
+# own process with its memory high-water mark reset, so the peak is that case's alone.
+#
+#     python benchmarks/image_decode.py [--megapixels 100] [--max-dimension 1600]
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(1, os.path.dirname(os.path.abspath(__file__)))
+
+import cv2
+
+import rss
+from corpus import make_image
+from image_decode import load_image, read_image_size, target_size
+
+
+def full_decode(path, max_dimension):
+    image = cv2.imread(path)
+    size = target_size(image.shape[1], image.shape[0], max_dimension=max_dimension)
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def reduced_decode(path, max_dimension):
+    return load_image(path, max_dimension=max_dimension)
+
+
+def run_case(func, path, max_dimension, results):
+    rss.reset_peak()
+    start = time.perf_counter()
+    image = func(path, max_dimension)
+    cv2.imencode('.webp', image)
+    elapsed = time.perf_counter() - start
+    results.put((elapsed, rss.peak_mb()))
+
+
+def measure(func, path, max_dimension):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_case, args=(func, path, max_dimension, results))
+    process.start()
+    elapsed, peak_mb = results.get()
+    process.join()
+    return elapsed, peak_mb
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--megapixels', type=float, default=100)
+    parser.add_argument('--max-dimension', type=int, default=1600)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        for ext in ('jpeg', 'png'):
+            path = os.path.join(folder, f'large.{ext}')
+            cv2.imwrite(path, make_image(args.megapixels, seed=0))
+            width, height = read_image_size(path)
+            print(f'{ext} {width}x{height} ({os.path.getsize(path) / 1e6:.1f} MB) -> max {args.max_dimension}px webp')
+            for label, func in (('full decode', full_decode), ('reduced decode', reduced_decode)):
+                elapsed, peak_mb = measure(func, path, args.max_dimension)
+                print(f'    {label:<16} {elapsed * 1000:9.1f} ms   peak RSS {peak_mb:8.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
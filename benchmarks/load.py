@@ -0,0 +1,227 @@
+# Throughput and latency of the debug server (app.run, as version.py starts it) against
+# serve.py (gunicorn) under concurrent clients. Each server gets a fresh working folder.
+# Scenarios: the index page, downloading a converted file, converting a small image in
+# the request, and the index page again while --slow-clients uploads trickle in, which
+# shows whether slow clients hold up everyone else.
+#
+#     python benchmarks/load.py [--servers dev,gunicorn] [--clients 16] [--duration 10]
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    # The reloader is left off so the server is one process that can be stopped cleanly
+    'dev': [sys.executable, '-c', 'import sys, version; version.app.run(port=int(sys.argv[1]), debug=True, '
+                                  'use_reloader=False)'],
+    'gunicorn': [sys.executable, os.path.join(ROOT, 'serve.py')],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(name, port, workdir, workers, threads):
+    env = dict(os.environ, PYTHONPATH=ROOT, WEB_BIND=f'127.0.0.1:{port}', WEB_WORKERS=str(workers),
+               WEB_THREADS=str(threads), WEB_LOG_LEVEL='warning')
+    command = SERVERS[name] + ([str(port)] if name == 'dev' else [])
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{name} server exited with {process.returncode}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            connection.close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{name} server did not start')
+
+
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+             for name, value in fields.items()]
+    for name, (filename, data) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def small_png():
+    image = np.zeros((256, 256, 3), dtype=np.uint8)
+    image[..., 0] = np.arange(256, dtype=np.uint8)
+    image[..., 1] = np.arange(256, dtype=np.uint8)[:, None]
+    return cv2.imencode('.png', image)[1].tobytes()
+
+
+def fetch(connection, method, path, body=None, headers=None):
+    connection.request(method, path, body=body, headers=headers or {})
+    response = connection.getresponse()
+    data = response.read()
+    return response.status, data
+
+
+def converted_file(port, png):
+    # Convert once as a job and return the download path of its result
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    body, content_type = multipart({'format': 'jpeg'}, {'image': ('load.png', png)})
+    status, data = fetch(connection, 'POST', '/upload_image', body,
+                         {'Content-Type': content_type, 'Accept': 'application/json'})
+    info = json.loads(data)
+    for _ in range(600):
+        status, data = fetch(connection, 'GET', info['status_url'], headers={'Accept': 'application/json'})
+        job = json.loads(data)
+        if job['finished'] is not None:
+            return f"/download_image/{job['result']}"
+        time.sleep(0.1)
+    raise RuntimeError('conversion did not finish')
+
+
+def slow_upload(port, stop, size=256 * 1024, chunk=4096, delay=0.05):
+    # Sends a multipart upload a few KiB at a time, over and over until stopped
+    body, content_type = multipart({'format': 'jpeg'}, {'image': ('slow.png', b'\0' * size)})
+    while not stop.is_set():
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            connection.putrequest('POST', '/upload_image')
+            connection.putheader('Content-Type', content_type)
+            connection.putheader('Content-Length', str(len(body)))
+            connection.endheaders()
+            for start in range(0, len(body), chunk):
+                if stop.is_set():
+                    break
+                connection.send(body[start:start + chunk])
+                time.sleep(delay)
+            connection.close()
+        except OSError:
+            time.sleep(delay)
+
+
+def run_clients(port, request, clients, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status, _ = request(connection)
+                ok = status < 400
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+        connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'per_s': round(len(latencies) / wall_time, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        'p95_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 1) if latencies else None,
+    }
+
+
+def bench_server(name, args, png):
+    port = free_port()
+    with tempfile.TemporaryDirectory() as workdir:
+        process = start_server(name, port, workdir, args.workers, args.threads)
+        try:
+            download = converted_file(port, png)
+            body, content_type = multipart({'format': 'jpeg'}, {'image': ('small.png', png)})
+            scenarios = {
+                'page': lambda connection: fetch(connection, 'GET', '/'),
+                'download': lambda connection: fetch(connection, 'GET', download),
+                'convert_small': lambda connection: fetch(connection, 'POST', '/upload_image', body,
+                                                          {'Content-Type': content_type}),
+            }
+            results = {}
+            for scenario, request in scenarios.items():
+                results[scenario] = run_clients(port, request, args.clients, args.duration)
+
+            stop = threading.Event()
+            slow = [threading.Thread(target=slow_upload, args=(port, stop), daemon=True)
+                    for _ in range(args.slow_clients)]
+            for thread in slow:
+                thread.start()
+            time.sleep(1)
+            results['page_with_slow_uploads'] = run_clients(port, scenarios['page'], args.clients, args.duration)
+            stop.set()
+            return results
+        finally:
+            process.terminate()
+            try:
+                process.wait(30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--servers', default='dev,gunicorn')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--slow-clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10, help='seconds per scenario')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='gunicorn web workers')
+    parser.add_argument('--threads', type=int, default=64, help='threads per gunicorn worker')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    png = small_png()
+    all_results = {}
+    for name in args.servers.split(','):
+        try:
+            all_results[name] = bench_server(name, args, png)
+        except RuntimeError as e:
+            print(f'{name}: {e}')
+            continue
+        for scenario, result in all_results[name].items():
+            print(f"{name:<9} {scenario:<24} {result['per_s']:8.1f} req/s   p50 {result['p50_ms']} ms   "
+                  f"p95 {result['p95_ms']} ms   errors {result['errors']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(all_results, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
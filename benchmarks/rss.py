@@ -0,0 +1,38 @@
+# Peak resident memory of the current process. A child started with fork or spawn begins
+# with its parent's high-water mark (ru_maxrss survives both fork and exec), so a case
+# measured in a fresh process calls reset_peak() first. On Linux writing 5 to
+# /proc/self/clear_refs resets the mark, which is then read back as VmHWM; elsewhere the
+# inherited ru_maxrss is all there is.
+import resource
+import sys
+
+
+def reset_peak():
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def peak_mb(children=False):
+    own = None
+    try:
+        with open('/proc/self/status', encoding='ascii') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    own = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if own is None:
+        own = maxrss_mb(resource.RUSAGE_SELF)
+    if children:
+        # Worker processes and subprocesses the case started
+        own = max(own, maxrss_mb(resource.RUSAGE_CHILDREN))
+    return own
+
+
+def maxrss_mb(who):
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    maxrss = resource.getrusage(who).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == 'darwin' else maxrss / 1024
@@ -0,0 +1,309 @@
+# Benchmark every converter in converters.py on the generated corpus (see corpus.py), then
+# drive the HTTP routes through Flask's test client. Records throughput, latency
+# percentiles and peak RSS per case and writes them as JSON; with --baseline the run is
+# compared against an earlier results file and regressions are reported.
+#
+#     python benchmarks/run.py [--iterations 5] [--output results.json] [--baseline old.json]
+#     python benchmarks/run.py --only image --skip-http
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus
+import rss
+
+# (name, function in converters.py, corpus input, arguments after the output folder)
+CASES = [
+    ('pdf_to_docx', 'convert_pdf_to_docx', 'pdf', ('docx',)),
+    ('docx_to_pdf', 'convert_docx_to_pdf', 'docx', ('pdf',)),
+    ('png_to_webp', 'convert_image', 'png', ('webp',)),
+    ('png_to_jpeg', 'convert_image', 'png', ('jpeg',)),
+    ('pdf_first_page', 'convert_pdf_page', 'pdf', ('png',)),
+    ('pdf_page_webp_150dpi', 'convert_pdf_page', 'pdf', ('webp', 1, 150)),
+    ('jpeg_to_png', 'convert_image', 'jpeg', ('png',)),
+    ('jpeg_to_jpeg_1600', 'convert_image', 'jpeg', ('jpeg', 1600)),
+    ('jpeg_derivatives', 'convert_image_derivatives', 'jpeg', ([('jpeg', 320, 80), ('webp', 1024, None), ('png', 2048, None)],)),
+    ('wav_to_mp3', 'convert_audio', 'wav', ('mp3',)),
+    ('mp3_to_opus', 'convert_audio', 'mp3', ('opus',)),
+    ('mp4_to_mkv_remux', 'convert_video', 'mp4', ('mkv',)),
+    ('mp4_to_mp4_single', 'convert_video', 'mp4', ('mp4', 'transcode', 1)),
+    ('mp4_to_mp4_segments', 'convert_video', 'mp4', ('mp4', 'transcode', os.cpu_count() or 1, 0)),
+    ('mp4_to_webm_segments', 'convert_video', 'mp4', ('webm', 'transcode', os.cpu_count() or 1, 0)),
+]
+
+# (name, route, corpus input, form fields, file field)
+HTTP_CASES = [
+    ('upload_file_pdf', '/upload_file', 'pdf', {'format': 'pdf'}, 'file'),
+    ('upload_file_doc', '/upload_file', 'docx', {'format': 'doc'}, 'file'),
+    ('upload_image_png', '/upload_image', 'png', {'format': 'webp', 'max_dimension': '1600'}, 'image'),
+    ('upload_image_jpeg', '/upload_image', 'jpeg', {'format': 'jpeg', 'max_dimension': '800'}, 'image'),
+    ('convert_pdf_page', '/convert', 'pdf', {'format': 'png', 'page': '1'}, 'file'),
+    ('upload_audio_mp3', '/upload_audio', 'mp3', {'format': 'ogg'}, 'audio'),
+    ('upload_video_mp4', '/upload_video', 'mp4', {'format': 'mkv'}, 'video'),
+]
+
+# Metrics compared against a baseline, and whether bigger is worse
+COMPARED = [('p50_ms', True), ('p95_ms', True), ('throughput_per_s', False), ('peak_rss_mb', True)]
+
+
+def percentile(values, fraction):
+    # Linear interpolation between closest ranks
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(latencies, input_bytes, wall_time, failures, rss_mb):
+    summary = {
+        'runs': len(latencies) + failures,
+        'failures': failures,
+        'p50_ms': None,
+        'p95_ms': None,
+        'p99_ms': None,
+        'throughput_per_s': None,
+        'throughput_mb_s': None,
+        'peak_rss_mb': round(rss_mb, 1),
+    }
+    if latencies:
+        summary.update({
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'throughput_per_s': round(len(latencies) / wall_time, 3),
+            'throughput_mb_s': round(input_bytes * len(latencies) / wall_time / 1e6, 3),
+        })
+    return summary
+
+
+def run_case(workdir, converter, input_path, args, iterations, warmup, results):
+    # Runs in a fresh process, so the RSS peak belongs to this converter alone
+    rss.reset_peak()
+    import converters
+
+    output_folder = os.path.join(workdir, 'converted')
+    os.makedirs(output_folder, exist_ok=True)
+    func = getattr(converters, converter)
+    latencies = []
+    failures = 0
+    started = None
+    for iteration in range(warmup + iterations):
+        if iteration == warmup:
+            started = time.perf_counter()
+        start = time.perf_counter()
+        output = func(input_path, output_folder, *args)
+        elapsed = time.perf_counter() - start
+        if output is None:
+            failures += iteration >= warmup
+            continue
+        os.remove(os.path.join(output_folder, output))
+        if iteration >= warmup:
+            latencies.append(elapsed)
+    wall_time = time.perf_counter() - started
+    results.put((latencies, wall_time, failures, rss.peak_mb(children=True)))
+
+
+def bench_converters(files, workdir, cases, iterations, warmup):
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name, converter, source, args in cases:
+        queue = context.Queue()
+        process = context.Process(target=run_case, args=(workdir, converter, files[source], args,
+                                                         iterations, warmup, queue))
+        process.start()
+        latencies, wall_time, failures, rss_mb = queue.get()
+        process.join()
+        results[name] = summarize(latencies, os.path.getsize(files[source]), wall_time, failures, rss_mb)
+        print_row(name, results[name])
+    return results
+
+
+def http_request(client, route, path, fields, field):
+    # Upload, wait for the job if one was queued, then download the result
+    import version
+
+    with open(path, 'rb') as f:
+        data = dict(fields, **{field: (f, os.path.basename(path))})
+        response = client.post(route, data=data, content_type='multipart/form-data',
+                               headers={'Accept': 'application/json'})
+    if response.status_code == 202:
+        info = response.get_json()
+        version.jobs.get(info['id']).wait()
+        response = client.get(info['result_url'])
+    body = response.get_data()
+    # Closing runs the response's close callbacks, which release admission slots
+    response.close()
+    return response.status_code == 200 and len(body) > 0
+
+
+def bench_http(files, workdir, cases, rounds, clients):
+    # The first round converts every input; later rounds repeat the same uploads and so
+    # measure the conversion cache. Requests within a round run from concurrent clients.
+    os.chdir(workdir)
+    rss.reset_peak()
+    import version
+
+    version.app.config['CONVERTED_FOLDER'] = os.path.abspath('converted')
+    local = threading.local()
+    sources = {case[0]: case[2] for case in cases}
+
+    def timed(case):
+        name, route, source, fields, field = case
+        if not hasattr(local, 'client'):
+            local.client = version.app.test_client()
+        start = time.perf_counter()
+        try:
+            ok = http_request(local.client, route, files[source], fields, field)
+        except Exception as e:
+            print(f'{name}: {e}')
+            ok = False
+        return name, time.perf_counter() - start, ok
+
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            for round_number in range(rounds):
+                label = 'cold' if round_number == 0 else 'cached'
+                started = time.perf_counter()
+                outcomes = list(executor.map(timed, cases))
+                wall_time = time.perf_counter() - started
+                for name, elapsed, ok in outcomes:
+                    entry = results.setdefault(f'{name}:{label}', {'latencies': [], 'failures': 0, 'wall': 0, 'bytes': 0})
+                    if ok:
+                        entry['latencies'].append(elapsed)
+                    else:
+                        entry['failures'] += 1
+                    entry['wall'] += wall_time
+                    entry['bytes'] = os.path.getsize(files[sources[name]])
+    finally:
+        version.jobs.shutdown()
+
+    rss_mb = rss.peak_mb(children=True)
+    summaries = {}
+    for name, entry in results.items():
+        summaries[name] = summarize(entry['latencies'], entry['bytes'], entry['wall'], entry['failures'], rss_mb)
+        print_row(name, summaries[name])
+    return summaries
+
+
+def run_http(files, workdir, cases, rounds, clients, results):
+    # Runs in a fresh process, so the peak RSS of the converter cases before it is not counted
+    results.put(bench_http(files, workdir, cases, rounds, clients))
+
+
+def bench_http_process(files, workdir, cases, rounds, clients):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=run_http, args=(files, workdir, cases, rounds, clients, queue))
+    process.start()
+    results = queue.get()
+    process.join()
+    return results
+
+
+def print_row(name, summary):
+    if summary['p50_ms'] is None:
+        print(f'{name:<28} failed ({summary["failures"]} of {summary["runs"]} runs)')
+        return
+    print(f'{name:<28} p50 {summary["p50_ms"]:9.1f} ms  p95 {summary["p95_ms"]:9.1f} ms  '
+          f'p99 {summary["p99_ms"]:9.1f} ms  {summary["throughput_per_s"]:7.2f}/s  '
+          f'{summary["throughput_mb_s"]:7.1f} MB/s  peak RSS {summary["peak_rss_mb"]:7.1f} MB'
+          + (f'  failures {summary["failures"]}' if summary['failures'] else ''))
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    # Print metrics that moved by more than tolerance; returns the number of regressions
+    regressions = 0
+    for section in ('converters', 'http'):
+        for name, summary in results.get(section, {}).items():
+            old = baseline.get(section, {}).get(name)
+            if old is None:
+                continue
+            for metric, bigger_is_worse in COMPARED:
+                new_value, old_value = summary.get(metric), old.get(metric)
+                if not new_value or not old_value:
+                    continue
+                change = (new_value - old_value) / old_value
+                if abs(change) <= tolerance:
+                    continue
+                worse = change > 0 if bigger_is_worse else change < 0
+                regressions += worse
+                print(f'{"REGRESSION" if worse else "improvement":<11} {section}/{name} {metric}: '
+                      f'{old_value} -> {new_value} ({change:+.0%})')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    corpus.add_arguments(parser)
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--only', help='run only cases whose name contains this text')
+    parser.add_argument('--skip-http', action='store_true')
+    parser.add_argument('--http-rounds', type=int, default=5)
+    parser.add_argument('--http-clients', type=int, default=4)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against an earlier results file')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='relative change ignored when comparing with the baseline')
+    args = parser.parse_args()
+
+    files = corpus.corpus_from_args(args)
+    with open(os.path.join(args.corpus, corpus.MANIFEST), 'r', encoding='utf-8') as manifest_file:
+        corpus_params = json.load(manifest_file)
+
+    cases = [case for case in CASES if not args.only or args.only in case[0]]
+    http_cases = [case for case in HTTP_CASES if not args.only or args.only in case[0]]
+    results = {
+        'revision': git_revision(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'corpus': corpus_params,
+        'iterations': args.iterations,
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        results['converters'] = bench_converters(files, workdir, cases, args.iterations, args.warmup)
+        if not args.skip_http and http_cases:
+            results['http'] = bench_http_process(files, workdir, http_cases, args.http_rounds, args.http_clients)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f'Results written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.tolerance)
+        print(f'{regressions} regression(s) against {args.baseline} (baseline revision {baseline.get("revision")})')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# Cold start time and RSS of a fresh process importing the app, as a web worker (import
+# only) and as a conversion worker (import, then prewarm every converter backend). Each
+# run is a new interpreter so nothing is cached between runs.
+#
+#     python benchmarks/startup.py [--runs 5] [--root path/to/checkout]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    'web worker': 'import version',
+    'conversion worker': 'import version\nfrom backends import prewarm\nprewarm()',
+    'eager imports': 'import cv2, fitz, numpy, pydub\nimport version',
+}
+
+PROBE = '''
+import resource, sys, time, json
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'modules': len(sys.modules)}}))
+'''
+
+
+def measure(root, code, runs):
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for _ in range(runs):
+            output = subprocess.run([sys.executable, '-c', PROBE.format(root=root, code=code)], cwd=workdir,
+                                    capture_output=True, text=True)
+            if output.returncode != 0:
+                return None, output.stderr.strip().splitlines()[-1]
+            results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    return results, None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--root', default=ROOT, help='checkout to measure, e.g. a worktree of an older commit')
+    args = parser.parse_args()
+
+    for label, code in SCENARIOS.items():
+        results, error = measure(os.path.abspath(args.root), code, args.runs)
+        if results is None:
+            print(f'{label:<18} failed: {error}')
+            continue
+        seconds = statistics.median(result['seconds'] for result in results)
+        rss_mb = statistics.median(result['rss_mb'] for result in results)
+        print(f'{label:<18} import {seconds * 1000:8.1f} ms   RSS {rss_mb:7.1f} MB   '
+              f'modules {results[0]["modules"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# Cost of the storage layer as the number of stored files grows: storing, looking a file
+# up by key and sweeping through the SQLite index, against the old full scan of one flat
+# folder. Nothing is old enough to expire, so both sweeps measure only finding candidates.
+#
+#     python benchmarks/storage.py [--files 1000,10000,50000]
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from outputs import cleanup_folder
+from storage import Storage
+
+
+def fill(storage, flat_folder, count):
+    keys = []
+    start = time.perf_counter()
+    for _ in range(count):
+        key = uuid.uuid4().hex
+        source = os.path.join(storage.folder, f'.{key}.tmp')
+        with open(source, 'wb') as f:
+            f.write(b'x')
+        storage.put(source, f'{key}.bin', key=key)
+        keys.append(key)
+    put_seconds = (time.perf_counter() - start) / count
+    for key in keys:
+        with open(os.path.join(flat_folder, f'{key}.bin'), 'wb') as f:
+            f.write(b'x')
+    return keys, put_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', default='1000,10000')
+    args = parser.parse_args()
+
+    for count in [int(value) for value in args.files.split(',')]:
+        with tempfile.TemporaryDirectory() as folder:
+            flat_folder = os.path.join(folder, 'flat')
+            os.makedirs(flat_folder)
+            storage = Storage(os.path.join(folder, 'sharded'), max_age=3600)
+            keys, put_seconds = fill(storage, flat_folder, count)
+
+            start = time.perf_counter()
+            for key in keys[::max(1, count // 1000)]:
+                storage.find(key)
+            find_seconds = (time.perf_counter() - start) / len(keys[::max(1, count // 1000)])
+
+            start = time.perf_counter()
+            storage.sweep()
+            sweep_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            cleanup_folder(flat_folder, 3600)
+            walk_seconds = time.perf_counter() - start
+
+        print(f'{count:>8} files   put {put_seconds * 1e3:7.3f} ms   find {find_seconds * 1e3:7.3f} ms   '
+              f'index sweep {sweep_seconds * 1e3:8.1f} ms   flat walk {walk_seconds * 1e3:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+# Convert whole directory trees offline with the converters the web app uses, spread over
+# a pool of processes and without any HTTP in between. The output tree mirrors the input
+# tree. Every finished file is appended to a manifest in the output folder, so an
+# interrupted run picks up where it stopped and a repeated run skips inputs that have
+# not changed since they were converted.
+#
+#     python bulk_convert.py archive/ converted-archive/ --format image=webp --format pdf=docx \
+#         --format audio=mp3 [--include '*.png' ...] [--exclude 'tmp/*' ...] [--option preset=small ...]
+#
+# --format maps an upload type (png, pdf, mp3, ...) or a group of them (image, audio, video)
+# to the output format; files of any other type are left alone.
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from werkzeug.datastructures import MultiDict
+
+from backends import prewarm
+from converters import find_converter, run_converter
+from upload_stream import sniff, SNIFF_BYTES, IMAGE_TYPES, AUDIO_TYPES, VIDEO_TYPES
+
+MANIFEST = '.bulk_convert.jsonl'
+
+TYPE_GROUPS = {
+    'image': IMAGE_TYPES,
+    'audio': AUDIO_TYPES,
+    'video': VIDEO_TYPES,
+}
+
+# Server-side converter settings. The pool already keeps every core busy with one file
+# per process, so converters that can split a file across processes are kept to one.
+SETTINGS = {
+    'max_pixels': 250 * 1000 * 1000,
+    'workers': 1,
+    'parallel_min_pages': 64,
+    'video_workers': 1,
+    'parallel_min_seconds': 60,
+}
+
+# Files handed to the pool ahead of the ones being converted, per worker
+PENDING_PER_WORKER = 4
+PROGRESS_INTERVAL = 1.0
+
+
+def target_format(file_type, formats):
+    # The exact type wins over a group
+    if file_type in formats:
+        return formats[file_type]
+    for group, types in TYPE_GROUPS.items():
+        if group in formats and file_type in types:
+            return formats[group]
+    return None
+
+
+def convert_file(source, destination, formats, options):
+    # Runs in a worker: sniff the file, pick its converter, convert next to the destination
+    # and move the output into place. destination has no extension yet.
+    start = time.perf_counter()
+    with open(source, 'rb') as source_file:
+        file_type = sniff(source_file.read(SNIFF_BYTES))
+    output_format = target_format(file_type, formats)
+    converter = find_converter(file_type, output_format) if output_format else None
+    if converter is None:
+        return {'status': 'unsupported', 'file_type': file_type}
+
+    output_path = f'{destination}.{output_format}'
+    folder = os.path.dirname(output_path)
+    os.makedirs(folder, exist_ok=True)
+    converter_options = converter.parse_options(MultiDict(options))
+    converter_options.update({name: SETTINGS[name] for name in converter.settings})
+    name = run_converter(source, converter.name, folder, output_format, converter_options)
+    if name is None:
+        return {'status': 'failed', 'file_type': file_type, 'error': f"Error converting {converter.kind}"}
+    os.replace(os.path.join(folder, name), output_path)
+    return {'status': 'done', 'file_type': file_type, 'output': output_path,
+            'bytes_out': os.path.getsize(output_path), 'seconds': round(time.perf_counter() - start, 6)}
+
+
+def matches(rel_path, patterns):
+    # A pattern matches the path relative to the source folder or just the file name
+    name = os.path.basename(rel_path)
+    return any(fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def walk(source, include, exclude, skip_folder=None):
+    # (relative path, size, mtime_ns) of every file to consider, in a stable order
+    for folder, folders, files in os.walk(source):
+        rel_folder = os.path.relpath(folder, source)
+        folders[:] = sorted(
+            name for name in folders
+            if os.path.abspath(os.path.join(folder, name)) != skip_folder
+            and not matches(os.path.normpath(os.path.join(rel_folder, name)).replace(os.sep, '/'), exclude))
+        for name in sorted(files):
+            rel_path = os.path.normpath(os.path.join(rel_folder, name)).replace(os.sep, '/')
+            if (include and not matches(rel_path, include)) or matches(rel_path, exclude):
+                continue
+            try:
+                stat = os.stat(os.path.join(folder, name))
+            except OSError:
+                continue
+            yield rel_path, stat.st_size, stat.st_mtime_ns
+
+
+def load_manifest(manifest_path):
+    # Latest entry per input file; a line cut short by a crash is ignored
+    entries = {}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+            for line in manifest_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[entry['path']] = entry
+    except OSError:
+        pass
+    return entries
+
+
+def unchanged(entry, size, mtime_ns, settings_key):
+    # Converted (or found unsupported) earlier, from the same bytes with the same settings
+    if entry is None or entry['size'] != size or entry['mtime_ns'] != mtime_ns or entry['settings'] != settings_key:
+        return False
+    if entry['status'] == 'done':
+        return os.path.exists(entry['output'])
+    return entry['status'] == 'unsupported'
+
+
+def plan(source, destination, include, exclude, manifest, settings_key, force):
+    # Files still to convert, each with its destination; two inputs that differ only in
+    # extension keep their full names so their outputs do not collide
+    tasks = []
+    skipped = 0
+    claimed = set()
+    for rel_path, size, mtime_ns in walk(source, include, exclude, destination):
+        stem = os.path.splitext(rel_path)[0]
+        if stem in claimed:
+            stem = rel_path
+        claimed.add(stem)
+        if not force and unchanged(manifest.get(rel_path), size, mtime_ns, settings_key):
+            skipped += 1
+            continue
+        tasks.append((rel_path, size, mtime_ns, os.path.join(destination, stem)))
+    return tasks, skipped
+
+
+def format_bytes(count):
+    return f'{count / 1e6:.1f} MB'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert every file in a directory tree.')
+    parser.add_argument('source')
+    parser.add_argument('destination')
+    parser.add_argument('--format', action='append', required=True, metavar='TYPE=FORMAT',
+                        help='output format for an upload type or group (image, audio, video); repeatable')
+    parser.add_argument('--include', action='append', default=[], metavar='GLOB',
+                        help='only convert matching files; repeatable')
+    parser.add_argument('--exclude', action='append', default=[], metavar='GLOB',
+                        help='skip matching files and folders; repeatable')
+    parser.add_argument('--option', action='append', default=[], metavar='NAME=VALUE',
+                        help='converter option such as preset=small or max_dimension=1600; repeatable')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--manifest', help=f'defaults to {MANIFEST} in the destination')
+    parser.add_argument('--force', action='store_true', help='convert again even if unchanged')
+    parser.add_argument('--quiet', action='store_true', help='no progress line')
+    args = parser.parse_args()
+
+    try:
+        formats = dict(value.split('=', 1) for value in args.format)
+        options = [tuple(value.split('=', 1)) for value in args.option]
+    except ValueError:
+        parser.error('--format and --option take NAME=VALUE')
+    if any(len(option) != 2 for option in options):
+        parser.error('--option takes NAME=VALUE')
+    if not os.path.isdir(args.source):
+        parser.error(f'{args.source} is not a folder')
+
+    # Outputs are recorded by absolute path so a later run from another folder still finds them
+    destination = os.path.abspath(args.destination)
+    os.makedirs(destination, exist_ok=True)
+    manifest_path = args.manifest or os.path.join(destination, MANIFEST)
+    settings_key = hashlib.sha256(json.dumps([formats, sorted(options)], sort_keys=True).encode()).hexdigest()[:16]
+    tasks, skipped = plan(args.source, destination, args.include, args.exclude,
+                          load_manifest(manifest_path), settings_key, args.force)
+
+    counts = {'done': 0, 'unsupported': 0, 'failed': 0}
+    bytes_in = 0
+    bytes_out = 0
+    failures = []
+    start = time.perf_counter()
+    last_progress = 0
+
+    def progress(final=False):
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        finished = sum(counts.values())
+        rate = finished / elapsed
+        eta = (len(tasks) - finished) / rate if rate else 0
+        sys.stderr.write(f'\r{finished}/{len(tasks)} files  {rate:.1f} files/s  {format_bytes(bytes_in / elapsed)}/s'
+                         f'  failed {counts["failed"]}  eta {eta:.0f}s ' + ('\n' if final else ''))
+        sys.stderr.flush()
+
+    window = max(1, args.workers) * PENDING_PER_WORKER
+    with open(manifest_path, 'a', encoding='utf-8') as manifest_file, \
+            ProcessPoolExecutor(max_workers=args.workers, initializer=prewarm) as executor:
+        remaining = iter(tasks)
+        running = {}
+        while True:
+            # Keep a bounded number of files queued, so 100k inputs are not all submitted up front
+            for task in remaining:
+                rel_path, size, mtime_ns, output_stem = task
+                future = executor.submit(convert_file, os.path.join(args.source, rel_path), output_stem, formats,
+                                         options)
+                running[future] = task
+                if len(running) >= window:
+                    break
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel_path, size, mtime_ns, _ = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'status': 'failed', 'error': str(e) or e.__class__.__name__}
+                counts[result['status']] += 1
+                if result['status'] == 'done':
+                    bytes_in += size
+                    bytes_out += result['bytes_out']
+                elif result['status'] == 'failed':
+                    failures.append(f"{rel_path}: {result['error']}")
+                entry = dict(result, path=rel_path, size=size, mtime_ns=mtime_ns, settings=settings_key)
+                manifest_file.write(json.dumps(entry) + '\n')
+                manifest_file.flush()
+            if not args.quiet and time.perf_counter() - last_progress >= PROGRESS_INTERVAL:
+                last_progress = time.perf_counter()
+                progress()
+
+    elapsed = time.perf_counter() - start
+    if not args.quiet:
+        progress(final=True)
+    print(f'Converted {counts["done"]}, unchanged {skipped}, unsupported {counts["unsupported"]}, '
+          f'failed {counts["failed"]} in {elapsed:.1f}s')
+    if elapsed and counts['done']:
+        print(f'{counts["done"] / elapsed:.1f} files/s, {format_bytes(bytes_in / elapsed)}/s in, '
+              f'{format_bytes(bytes_out / elapsed)}/s out with {args.workers} workers')
+    for failure in failures:
+        print(f'Failed: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,49 @@
+import hashlib
+import json
+import os
+
+from metrics import CACHE_REQUESTS
+
+# Read uploads in 1 MiB chunks while hashing
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ConversionCache:
+    # Converted outputs named <key>.<ext>, where the key hashes the uploaded bytes, the
+    # target format and the converter options. They are kept in a Storage, which expires
+    # them and evicts the least recently used once its quota is exceeded.
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def key(self, file_path, output_format, options=None, content_hash=None):
+        digest = hashlib.sha256()
+        digest.update((content_hash or hash_file(file_path)).encode())
+        digest.update(output_format.encode())
+        digest.update(json.dumps(options or {}, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        filename = self.storage.find(key)
+        CACHE_REQUESTS.inc(result='miss' if filename is None else 'hit')
+        return filename
+
+    def put(self, key, converted_path, sha256=None):
+        # Store the converter output under its content address and return that name,
+        # with the hash of the output itself, which is served as its ETag. Callers that
+        # still hold the output in memory pass its sha256 so the file is not read back.
+        ext = os.path.splitext(converted_path)[1]
+        return self.storage.put(converted_path, f'{key}{ext}', key=key, sha256=sha256 or hash_file(converted_path))
+
+    def content_hash(self, filename):
+        # sha256 of a cached output, or None for files the cache does not know
+        info = self.storage.info(filename)
+        return info['sha256'] if info is not None else None
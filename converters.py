@@ -0,0 +1,381 @@
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.utils import secure_filename
+
+from audio_stream import AUDIO_MIMETYPES
+from backends import load_backend
+from docx_writer import DocxWriter, DOCX_MIMETYPE
+from encoder_presets import ENCODER_PRESETS, preset_params
+from metrics import stage, timed_iter
+from outputs import atomic_output, ChunkBuffer
+from upload_stream import IMAGE_TYPES, AUDIO_TYPES, VIDEO_TYPES
+from video_transcode import VIDEO_MIMETYPES, VIDEO_MODES
+
+# imwrite parameter that takes a 0-100 quality for each lossy format
+QUALITY_PARAMS = {
+    'jpeg': 'IMWRITE_JPEG_QUALITY',
+    'webp': 'IMWRITE_WEBP_QUALITY',
+}
+
+IMAGE_MIMETYPES = {
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp',
+}
+
+# Resolution PDF pages are rendered at unless the request asks for another, and the most it may ask for
+PDF_DEFAULT_DPI = 96
+PDF_MAX_DPI = 600
+
+
+def write_pdf_pages(docx, file_path, workers=1, parallel_min_pages=64):
+    # Yields after each page so streaming callers can flush what has been written
+    pages = load_backend('pdf').iter_pdf_paragraphs(file_path, workers, parallel_min_pages)
+    for page_number, paragraphs in enumerate(timed_iter(pages, 'pdf_extract')):
+        with stage('docx_write'):
+            if page_number:
+                docx.add_page_break()
+            for paragraph in paragraphs:
+                docx.add_paragraph(paragraph)
+        yield page_number
+
+
+def convert_pdf_to_docx(file_path, output_folder, output_format='docx', workers=1, parallel_min_pages=64):
+    try:
+        # Write each page into the document as soon as it is extracted
+        with atomic_output(output_folder, 'docx') as output:
+            with DocxWriter(output.path) as docx:
+                for _ in write_pdf_pages(docx, file_path, workers, parallel_min_pages):
+                    pass
+
+        return output.name
+    except Exception as e:
+        print(f"Error converting PDF to DOCX: {e}")
+        return None
+
+
+def iter_pdf_to_docx(file_path, output_format='docx', workers=1, parallel_min_pages=64):
+    # The DOCX page by page, while the rest of the document is still being extracted
+    buffer = ChunkBuffer()
+    with DocxWriter(buffer) as docx:
+        for _ in write_pdf_pages(docx, file_path, workers, parallel_min_pages):
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def convert_docx_to_pdf(file_path, output_folder, output_format='pdf'):
+    try:
+        # Lay the document out with fitz in-process instead of driving an office application
+        with atomic_output(output_folder, 'pdf') as output, stage('docx_render'):
+            load_backend('docx').get_renderer().render(file_path, output.path)
+        return output.name
+    except Exception as e:
+        print(f"Error converting DOCX to PDF: {e}")
+        return None
+
+
+def encode_image(image, output_format, quality=None, preset=None):
+    # Convert the image to the desired format; an explicit quality overrides the preset's
+    cv2 = load_backend('opencv')
+    params = preset_params(preset, output_format)
+    if quality and output_format in QUALITY_PARAMS:
+        params += [getattr(cv2, QUALITY_PARAMS[output_format]), quality]
+    _, buffer = cv2.imencode(f".{output_format}", image, params)
+    return buffer
+
+
+def convert_image(file_path, output_folder, output_format, max_dimension=None, width=None, height=None,
+                  preset=None, max_pixels=None):
+    try:
+        # Read the image using OpenCV, decoding at reduced resolution when a smaller output is wanted
+        with stage('image_decode'):
+            image = load_backend('image').load_image(file_path, width, height, max_dimension, max_pixels)
+
+        with stage('image_encode'):
+            buffer = encode_image(image, output_format, preset=preset)
+        with atomic_output(output_folder, output_format) as output, stage('output_write'):
+            with open(output.path, 'wb') as image_file:
+                image_file.write(buffer)
+
+        return output.name
+    except Exception as e:
+        print(f"Error converting image: {e}")
+        return None
+
+
+def convert_image_buffer(buffer, output_format, max_dimension=None, width=None, height=None,
+                         preset=None, max_pixels=None):
+    # convert_image for an upload still in memory; returns the encoded bytes
+    with stage('image_decode'):
+        image = load_backend('image').decode_image(buffer, width, height, max_dimension, max_pixels)
+    with stage('image_encode'):
+        return encode_image(image, output_format, preset=preset).tobytes()
+
+
+def convert_image_derivatives(file_path, output_folder, targets, preset=None, max_pixels=None):
+    # targets is a list of (format, max_dimension, quality). The source is decoded once,
+    # at the resolution the largest target needs, and the targets are encoded in
+    # parallel threads from that shared pixel buffer (OpenCV releases the GIL).
+    # All outputs are returned together as one ZIP. The encoder preset applies to every target.
+    try:
+        sizes = [max_dimension for _, max_dimension, _ in targets]
+        largest = None if None in sizes else max(sizes)
+        images = load_backend('image')
+        with stage('image_decode'):
+            image = images.load_image(file_path, max_dimension=largest, max_pixels=max_pixels)
+
+        def derive(target):
+            output_format, max_dimension, quality = target
+            size = images.target_size(image.shape[1], image.shape[0], max_dimension=max_dimension)
+            return size, encode_image(images.resize_tiled(image, size), output_format, quality, preset)
+
+        with stage('image_encode'), ThreadPoolExecutor(max_workers=min(len(targets), os.cpu_count() or 1)) as executor:
+            results = list(executor.map(derive, targets))
+
+        with atomic_output(output_folder, 'zip') as output, stage('output_write'):
+            with zipfile.ZipFile(output.path, 'w', zipfile.ZIP_STORED) as archive:
+                used_names = set()
+                for (output_format, _, quality), ((width, height), buffer) in zip(targets, results):
+                    stem = f'{width}x{height}' + (f'-q{quality}' if quality else '')
+                    archive.writestr(batch_member_name(stem, output_format, used_names), buffer.tobytes())
+        return output.name
+    except Exception as e:
+        print(f"Error converting image derivatives: {e}")
+        return None
+
+
+def parse_derivative_targets(spec):
+    # "jpeg:320:80,png:1024,webp" -> [('jpeg', 320, 80), ('png', 1024, None), ('webp', None, None)]
+    targets = []
+    for item in spec.split(','):
+        parts = item.strip().split(':')
+        if not parts[0] or len(parts) > 3 or parts[0] not in IMAGE_MIMETYPES:
+            raise ValueError(f"Invalid target: {item}")
+        max_dimension = int(parts[1]) if len(parts) > 1 and parts[1] else None
+        quality = int(parts[2]) if len(parts) > 2 and parts[2] else None
+        if (max_dimension is not None and max_dimension < 1) or (quality is not None and not 0 <= quality <= 100):
+            raise ValueError(f"Invalid target: {item}")
+        targets.append((parts[0], max_dimension, quality))
+    return targets
+
+
+def convert_pdf_page(file_path, output_folder, output_format, page=1, dpi=PDF_DEFAULT_DPI, preset=None,
+                     max_pixels=None):
+    try:
+        # The page's pixmap goes straight to the image encoder, with no intermediate file
+        with stage('pdf_render'):
+            image = load_backend('raster').render_page(file_path, page, dpi, max_pixels)
+        with stage('image_encode'):
+            buffer = encode_image(image, output_format, preset=preset)
+        with atomic_output(output_folder, output_format) as output, stage('output_write'):
+            with open(output.path, 'wb') as image_file:
+                image_file.write(buffer)
+        return output.name
+    except Exception as e:
+        print(f"Error rendering PDF page: {e}")
+        return None
+
+
+def convert_pdf_page_buffer(buffer, output_format, page=1, dpi=PDF_DEFAULT_DPI, preset=None, max_pixels=None):
+    # convert_pdf_page for an upload still in memory; returns the encoded bytes
+    with stage('pdf_render'):
+        image = load_backend('raster').render_page(buffer, page, dpi, max_pixels)
+    with stage('image_encode'):
+        return encode_image(image, output_format, preset=preset).tobytes()
+
+
+def parse_page_ranges(spec, page_count):
+    # "1-3,7,10-" -> [1, 2, 3, 7, 10, ..., page_count]; pages count from 1, repeats are dropped
+    pages = []
+    seen = set()
+    for item in spec.split(','):
+        first, dash, last = item.strip().partition('-')
+        try:
+            start = int(first) if first else 1
+            stop = (int(last) if last else page_count) if dash else start
+        except ValueError:
+            raise ValueError(f"Invalid page range: {item}")
+        if not 1 <= start <= stop <= page_count:
+            raise ValueError(f"Invalid page range: {item} (the document has {page_count} pages)")
+        for page in range(start, stop + 1):
+            if page not in seen:
+                seen.add(page)
+                pages.append(page)
+    return pages
+
+
+def convert_audio(file_path, output_folder, output_format):
+    try:
+        # Transcode with ffmpeg frame by frame instead of decoding the whole track into memory
+        with atomic_output(output_folder, output_format) as output, stage('audio_transcode'):
+            load_backend('audio').transcode(file_path, output.path, output_format)
+        return output.name
+
+    except Exception as e:
+        print(f"Error converting audio: {e}")
+        return None
+
+
+def iter_audio(file_path, output_format):
+    # The encoded audio, while ffmpeg is still producing it
+    return load_backend('audio').iter_transcode(file_path, output_format)
+
+
+def convert_video(file_path, output_folder, output_format, mode='auto', video_workers=1, parallel_min_seconds=60):
+    try:
+        # Copy the streams when the target container takes their codecs; otherwise cut the
+        # video at keyframes and encode the segments in parallel
+        with atomic_output(output_folder, output_format) as output:
+            load_backend('video').transcode(file_path, output.path, output_format, mode, video_workers,
+                                            parallel_min_seconds)
+        return output.name
+    except Exception as e:
+        print(f"Error converting video: {e}")
+        return None
+
+
+def batch_member_name(filename, output_format, used_names):
+    stem = os.path.splitext(secure_filename(filename))[0] or 'converted'
+    name = f'{stem}.{output_format}'
+    number = 1
+    while name in used_names:
+        number += 1
+        name = f'{stem}-{number}.{output_format}'
+    used_names.add(name)
+    return name
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise ValueError(f"Expected a positive number: {value}")
+    return number
+
+
+def preset_name(value):
+    if value not in ENCODER_PRESETS:
+        raise ValueError(f"Unknown encoder preset: {value}")
+    return value
+
+
+def dpi_value(value):
+    number = positive_int(value)
+    if number > PDF_MAX_DPI:
+        raise ValueError(f"Resolution is above {PDF_MAX_DPI} dpi: {value}")
+    return number
+
+
+def video_mode(value):
+    if value not in VIDEO_MODES:
+        raise ValueError(f"Unknown video mode: {value}")
+    return value
+
+
+IMAGE_OPTIONS = {
+    'max_dimension': positive_int,
+    'width': positive_int,
+    'height': positive_int,
+    'preset': preset_name,
+}
+
+PDF_PAGE_OPTIONS = {
+    'page': positive_int,
+    'dpi': dpi_value,
+    'preset': preset_name,
+}
+
+
+class Converter:
+    # One conversion the app offers, from any of `sources` (sniffed upload types) to any
+    # of the formats in `mimetypes`. convert(file_path, output_folder, output_format,
+    # **options) writes a file and returns its name, or None on failure. Optional
+    # capabilities: stream(file_path, output_format, **options) yields the output while
+    # it is produced, and convert_buffer(buffer, output_format, **options) converts an
+    # upload that is still in memory. `options` maps request fields to parsers; `settings`
+    # names server-side settings the app passes in as extra keyword arguments.
+
+    def __init__(self, name, kind, sources, mimetypes, convert, options=None, settings=(),
+                 stream=None, convert_buffer=None, parallel=False):
+        self.name = name
+        self.kind = kind
+        self.sources = frozenset(sources)
+        self.mimetypes = mimetypes
+        self.convert = convert
+        self.options = options or {}
+        self.settings = tuple(settings)
+        self.stream = stream
+        self.convert_buffer = convert_buffer
+        self.parallel = parallel
+
+    @property
+    def targets(self):
+        return set(self.mimetypes)
+
+    def capabilities(self):
+        return {
+            'streaming': self.stream is not None,
+            'in_memory': self.convert_buffer is not None,
+            'parallel': self.parallel,
+        }
+
+    def parse_options(self, form):
+        # Missing or invalid values are left out rather than failing the request
+        options = {}
+        for name, parser in self.options.items():
+            value = form.get(name, type=parser)
+            if value is not None:
+                options[name] = value
+        return options
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'sources': sorted(source or 'unknown' for source in self.sources),
+            'targets': sorted(self.targets),
+            'options': sorted(self.options),
+            'capabilities': self.capabilities(),
+        }
+
+
+CONVERTERS = {}
+
+
+def register_converter(converter):
+    CONVERTERS[converter.name] = converter
+    return converter
+
+
+def find_converter(file_type, output_format, kinds=None):
+    for converter in CONVERTERS.values():
+        if kinds is not None and converter.kind not in kinds:
+            continue
+        if file_type in converter.sources and output_format in converter.mimetypes:
+            return converter
+    return None
+
+
+def run_converter(file_path, name, output_folder, output_format, options):
+    # Module-level entry point for the worker pool; converters are looked up by name
+    # because the registry entries themselves do not need to be picklable
+    return CONVERTERS[name].convert(file_path, output_folder, output_format, **options)
+
+
+register_converter(Converter('pdf_to_docx', 'file', {'pdf'}, {'docx': DOCX_MIMETYPE}, convert_pdf_to_docx,
+                             settings=('workers', 'parallel_min_pages'), stream=iter_pdf_to_docx, parallel=True))
+register_converter(Converter('docx_to_pdf', 'file', {'zip'}, {'pdf': 'application/pdf'}, convert_docx_to_pdf))
+register_converter(Converter('image', 'image', IMAGE_TYPES, IMAGE_MIMETYPES, convert_image,
+                             options=IMAGE_OPTIONS, settings=('max_pixels',), convert_buffer=convert_image_buffer))
+register_converter(Converter('pdf_pages', 'raster', {'pdf'}, IMAGE_MIMETYPES, convert_pdf_page,
+                             options=PDF_PAGE_OPTIONS, settings=('max_pixels',),
+                             convert_buffer=convert_pdf_page_buffer))
+# Ahead of audio, so /convert sends an MP4 to MP4 request through the video converter;
+# a file without a video stream still comes out as audio in the target container
+register_converter(Converter('video', 'video', VIDEO_TYPES | {None}, VIDEO_MIMETYPES, convert_video,
+                             options={'mode': video_mode}, settings=('video_workers', 'parallel_min_seconds'),
+                             parallel=True))
+# Containers the sniffer does not recognise (None) are left for ffmpeg to judge
+register_converter(Converter('audio', 'audio', AUDIO_TYPES | {None}, AUDIO_MIMETYPES, convert_audio,
+                             stream=iter_audio))
@@ -0,0 +1,150 @@
+import zipfile
+import xml.etree.ElementTree as ET
+
+import fitz
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+# Font sizes for paragraph styles that should stand out from body text
+HEADING_SIZES = {
+    'Title': 22,
+    'Heading1': 18,
+    'Heading2': 15,
+    'Heading3': 13,
+}
+
+PAGE_BREAK = '\f'
+
+
+def iter_docx_paragraphs(docx_path):
+    # Yield (style, text) for each paragraph of word/document.xml, clearing parsed
+    # elements as we go so large documents are read in bounded memory
+    with zipfile.ZipFile(docx_path) as docx:
+        with docx.open('word/document.xml') as document:
+            for _, element in ET.iterparse(document):
+                if element.tag != f'{W}p':
+                    continue
+                style = element.find(f'{W}pPr/{W}pStyle')
+                parts = []
+                for node in element.iter():
+                    if node.tag == f'{W}t' and node.text:
+                        parts.append(node.text)
+                    elif node.tag == f'{W}tab':
+                        parts.append('\t')
+                    elif node.tag in (f'{W}br', f'{W}cr'):
+                        parts.append(PAGE_BREAK if node.get(f'{W}type') == 'page' else '\n')
+                yield (style.get(f'{W}val') if style is not None else None), ''.join(parts)
+                element.clear()
+
+
+class DocxRenderer:
+    # Lays out DOCX paragraphs onto PDF pages with fitz, without starting an office
+    # application. Fonts are loaded once, so a single instance can be reused for
+    # many documents.
+
+    def __init__(self, paper='a4', margin=72, fontsize=11, fontname='helv', bold_fontname='hebo'):
+        self.page_rect = fitz.paper_rect(paper)
+        self.margin = margin
+        self.fontsize = fontsize
+        self.font = fitz.Font(fontname)
+        self.bold_font = fitz.Font(bold_fontname)
+        self._advances = {}
+
+    def render(self, docx_path, pdf_path):
+        pdf_document = fitz.open()
+        self._page = None
+        self._pdf_document = pdf_document
+        try:
+            for style, text in iter_docx_paragraphs(docx_path):
+                self._add_paragraph(style, text)
+            if self._page is None:
+                self._new_page()
+            self._flush_page()
+            pdf_document.save(pdf_path, garbage=3, deflate=True)
+        finally:
+            self._pdf_document = None
+            self._writer = None
+            pdf_document.close()
+
+    def _new_page(self):
+        self._flush_page()
+        self._page = self._pdf_document.new_page(width=self.page_rect.width, height=self.page_rect.height)
+        self._writer = fitz.TextWriter(self._page.rect)
+        self._y = self.margin
+
+    def _flush_page(self):
+        if self._page is not None:
+            self._writer.write_text(self._page)
+
+    def _add_paragraph(self, style, text):
+        fontsize = HEADING_SIZES.get(style, self.fontsize)
+        font = self.bold_font if style in HEADING_SIZES else self.font
+        line_height = fontsize * 1.3
+        if self._page is None:
+            self._new_page()
+
+        for block_number, block in enumerate(text.split(PAGE_BREAK)):
+            if block_number:
+                self._new_page()
+            for line in block.split('\n'):
+                for wrapped in self._wrap(line.replace('\t', '    '), font, fontsize):
+                    if self._y + line_height > self.page_rect.height - self.margin:
+                        self._new_page()
+                    self._y += line_height
+                    self._writer.append((self.margin, self._y), wrapped, font=font, fontsize=fontsize)
+        self._y += fontsize * 0.5
+
+    def _text_width(self, text, font, fontsize):
+        # Glyph advances are cached per font, since measuring through fitz is slow
+        # and a warm renderer sees the same characters over and over
+        advances = self._advances.setdefault(font.name, {})
+        width = 0
+        for char in text:
+            advance = advances.get(char)
+            if advance is None:
+                advance = advances[char] = font.glyph_advance(ord(char))
+            width += advance
+        return width * fontsize
+
+    def _wrap(self, line, font, fontsize):
+        # Greedy word wrap; words wider than the line are split by character
+        width = self.page_rect.width - 2 * self.margin
+        space = self._text_width(' ', font, fontsize)
+        current = ''
+        current_width = 0
+        for word in line.split(' '):
+            word_width = self._text_width(word, font, fontsize)
+            if not current and word_width <= width:
+                current, current_width = word, word_width
+                continue
+            if current and current_width + space + word_width <= width:
+                current += ' ' + word
+                current_width += space + word_width
+                continue
+            if current:
+                yield current
+            if word_width <= width:
+                current, current_width = word, word_width
+                continue
+            current = ''
+            current_width = 0
+            for char in word:
+                char_width = self._text_width(char, font, fontsize)
+                if current and current_width + char_width > width:
+                    yield current
+                    current = ''
+                    current_width = 0
+                current += char
+                current_width += char_width
+        yield current
+
+
+renderer = None
+
+
+def get_renderer():
+    # Warm instance shared by every conversion in this process
+    global renderer
+    if renderer is None:
+        renderer = DocxRenderer()
+    return renderer
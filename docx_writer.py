@@ -0,0 +1,75 @@
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+
+RELATIONSHIPS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+DOCUMENT_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+)
+
+DOCUMENT_END = '<w:sectPr/></w:body></w:document>'
+
+PAGE_BREAK = '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# Control characters that are not allowed in XML 1.0
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class DocxWriter:
+    # Writes a minimal WordprocessingML package. Paragraphs go straight into the
+    # compressed word/document.xml part as they are added, so no document tree is
+    # kept in memory. The target may be a path or any writable file object, including
+    # non-seekable streams.
+
+    def __init__(self, file):
+        self._zip = zipfile.ZipFile(file, 'w', zipfile.ZIP_DEFLATED)
+        self._zip.writestr('[Content_Types].xml', CONTENT_TYPES)
+        self._zip.writestr('_rels/.rels', RELATIONSHIPS)
+        self._document = self._zip.open('word/document.xml', 'w', force_zip64=True)
+        self._write(DOCUMENT_START)
+
+    def _write(self, xml):
+        self._document.write(xml.encode('utf-8'))
+
+    def add_paragraph(self, text):
+        lines = INVALID_XML_CHARS.sub('', text).split('\n')
+        runs = '<w:br/>'.join(f'<w:t xml:space="preserve">{escape(line)}</w:t>' for line in lines)
+        self._write(f'<w:p><w:r>{runs}</w:r></w:p>')
+
+    def add_page_break(self):
+        self._write(PAGE_BREAK)
+
+    def close(self):
+        if self._document is None:
+            return
+        self._write(DOCUMENT_END)
+        self._document.close()
+        self._document = None
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,34 @@
+from backends import load_backend
+
+# Named encoder settings per output format, passed to cv2.imencode as IMWRITE_* pairs.
+# Parameters are named rather than given as cv2 constants so OpenCV is only loaded
+# when something is encoded. Formats missing from a preset use OpenCV's defaults.
+ENCODER_PRESETS = {
+    # Lowest encode time; larger files. OpenCV's own PNG settings already encode fastest.
+    'fast': {
+        'jpeg': [('IMWRITE_JPEG_QUALITY', 85)],
+        'webp': [('IMWRITE_WEBP_QUALITY', 80)],
+    },
+    # Smallest download at acceptable quality; progressive JPEGs render early on slow links
+    'small': {
+        'jpeg': [('IMWRITE_JPEG_QUALITY', 70), ('IMWRITE_JPEG_PROGRESSIVE', 1), ('IMWRITE_JPEG_OPTIMIZE', 1)],
+        'png': [('IMWRITE_PNG_COMPRESSION', 9)],
+        'webp': [('IMWRITE_WEBP_QUALITY', 60)],
+    },
+    # Pixel-exact output where the format allows it (JPEG is always lossy, so use its best quality)
+    'lossless': {
+        'jpeg': [('IMWRITE_JPEG_QUALITY', 100), ('IMWRITE_JPEG_OPTIMIZE', 1)],
+        'png': [('IMWRITE_PNG_COMPRESSION', 9)],
+        'webp': [('IMWRITE_WEBP_QUALITY', 101)],
+    },
+}
+
+
+def preset_params(preset, output_format):
+    if preset is None:
+        return []
+    cv2 = load_backend('opencv')
+    params = []
+    for name, value in ENCODER_PRESETS[preset].get(output_format, []):
+        params += [getattr(cv2, name), value]
+    return params
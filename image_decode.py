@@ -0,0 +1,269 @@
+import mmap
+import os
+import struct
+
+import cv2
+import numpy as np
+
+# Decoded images above this many pixels are resized strip by strip
+TILE_PIXELS = 16 * 1024 * 1024
+# Rows per strip when resizing in tiles
+TILE_ROWS = 512
+
+REDUCED_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+
+# EXIF orientations under which the decoders turn the image a quarter turn, so the
+# decoded image is as wide as the stored one is tall
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+ORIENTATION_TAG = 274
+
+
+def read_image_size(file_path):
+    # Read (width, height) from the file header without decoding any pixels.
+    # Returns None for formats that are not recognised.
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return image_size(data)
+
+
+def image_size(data):
+    # Same as read_image_size for an in-memory buffer (bytes, memoryview or mmap). Like
+    # cv2.imread, this applies the EXIF orientation: a photo stored sideways reports the
+    # size it is displayed at.
+    size = _stored_size(data)
+    if size is not None and _orientation(data) in TRANSPOSED_ORIENTATIONS:
+        return size[1], size[0]
+    return size
+
+
+def _stored_size(data):
+    head = bytes(data[:32])
+    if head[:8] == b'\x89PNG\r\n\x1a\n':
+        return struct.unpack('>II', head[16:24])
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return struct.unpack('<HH', head[6:10])
+    if head[:2] == b'BM':
+        width, height = struct.unpack('<ii', head[18:26])
+        return width, abs(height)
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return _webp_size(head)
+    if head[:2] == b'\xff\xd8':
+        return _jpeg_size(data)
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return _tiff_size(data)
+    return None
+
+
+def _orientation(data):
+    # EXIF orientation (1 to 8, 1 when there is none) of the formats OpenCV rotates on decoding
+    head = bytes(data[:16])
+    if head[:2] == b'\xff\xd8':
+        exif = _jpeg_exif(data)
+    elif head[:4] in (b'II*\x00', b'MM\x00*'):
+        exif = 0
+    elif head[:8] == b'\x89PNG\r\n\x1a\n':
+        exif = _png_exif(data)
+    elif head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        exif = _webp_exif(data)
+    else:
+        exif = None
+    if exif is None:
+        return 1
+    return _tiff_tags(data, exif).get(ORIENTATION_TAG, 1)
+
+
+def _webp_size(head):
+    chunk = head[12:16]
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', head[26:30])
+        return width & 0x3fff, height & 0x3fff
+    if chunk == b'VP8L':
+        bits = struct.unpack('<I', head[21:25])[0]
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    if chunk == b'VP8X':
+        width = int.from_bytes(head[24:27], 'little') + 1
+        height = int.from_bytes(head[27:30], 'little') + 1
+        return width, height
+    return None
+
+
+def _webp_exif(data):
+    # Offset of the TIFF structure in the EXIF chunk, found by walking the RIFF chunks
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk, length = struct.unpack('<4sI', bytes(data[offset:offset + 8]))
+        if chunk == b'EXIF':
+            start = offset + 8
+            # Some writers keep the "Exif" prefix of the JPEG segment
+            return start + 6 if bytes(data[start:start + 6]) == b'Exif\x00\x00' else start
+        offset += 8 + length + (length & 1)
+    return None
+
+
+def _png_exif(data):
+    # Offset of the eXIf chunk's TIFF structure
+    offset = 8
+    while offset + 8 <= len(data):
+        length, chunk = struct.unpack('>I4s', bytes(data[offset:offset + 8]))
+        if chunk == b'eXIf':
+            return offset + 8
+        if chunk == b'IEND':
+            return None
+        offset += 12 + length
+    return None
+
+
+def _jpeg_segments(data):
+    # (marker code, offset, length) of each marker segment up to the image data
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xff:
+            return
+        code = data[offset + 1]
+        if code == 0xff:
+            offset += 1
+            continue
+        if code in (0xd8, 0x01) or 0xd0 <= code <= 0xd7:
+            offset += 2
+            continue
+        if code == 0xda:
+            return
+        length = struct.unpack('>H', bytes(data[offset + 2:offset + 4]))[0]
+        yield code, offset, length
+        offset += 2 + length
+
+
+def _jpeg_size(data):
+    # Dimensions from the first start-of-frame segment
+    for code, offset, length in _jpeg_segments(data):
+        if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>xHH', bytes(data[offset + 4:offset + 9]))
+            return width, height
+    return None
+
+
+def _jpeg_exif(data):
+    # Offset of the TIFF structure in the APP1 "Exif" segment
+    for code, offset, length in _jpeg_segments(data):
+        if code == 0xe1 and bytes(data[offset + 4:offset + 10]) == b'Exif\x00\x00':
+            return offset + 10
+    return None
+
+
+def _tiff_tags(data, base=0):
+    # {tag: value} of the SHORT and LONG entries in the first image file directory of the
+    # TIFF structure at base: a TIFF file, or the EXIF block of another format. Offsets
+    # inside the structure count from base.
+    order = {b'II': '<', b'MM': '>'}.get(bytes(data[base:base + 2]))
+    if order is None or base + 8 > len(data):
+        return {}
+    offset = base + struct.unpack(order + 'I', bytes(data[base + 4:base + 8]))[0]
+    if offset + 2 > len(data):
+        return {}
+    count = struct.unpack(order + 'H', bytes(data[offset:offset + 2]))[0]
+    tags = {}
+    for entry in range(offset + 2, min(offset + 2 + count * 12, len(data) - 11), 12):
+        tag, value_type = struct.unpack(order + 'HH', bytes(data[entry:entry + 4]))
+        if value_type in (3, 4):
+            # SHORT values sit in the first two bytes of the value field, LONG values fill it
+            value_format = order + ('H' if value_type == 3 else 'I')
+            tags[tag] = struct.unpack_from(value_format, bytes(data[entry + 8:entry + 12]))[0]
+    return tags
+
+
+def _tiff_size(data):
+    # ImageWidth (256) and ImageLength (257) from the first image file directory
+    tags = _tiff_tags(data)
+    if 256 not in tags or 257 not in tags:
+        return None
+    return tags[256], tags[257]
+
+
+def target_size(width, height, resize_width=None, resize_height=None, max_dimension=None):
+    # Explicit sizes keep the aspect ratio when only one side is given;
+    # max_dimension only ever shrinks the longest side
+    if resize_width and resize_height:
+        width, height = resize_width, resize_height
+    elif resize_width:
+        width, height = resize_width, max(1, round(height * resize_width / width))
+    elif resize_height:
+        width, height = max(1, round(width * resize_height / height)), resize_height
+    if max_dimension and max(width, height) > max_dimension:
+        scale = max_dimension / max(width, height)
+        width, height = max(1, round(width * scale)), max(1, round(height * scale))
+    return width, height
+
+
+def load_image(file_path, resize_width=None, resize_height=None, max_dimension=None, max_pixels=None):
+    # Decode an image no larger than needed for the requested size. JPEGs are scaled
+    # by libjpeg during decoding (1/2, 1/4 or 1/8), so the full-resolution pixels are
+    # never materialised; the rest of the resize happens strip by strip for huge images.
+    # Images that would still decode to more than max_pixels are refused up front.
+    size = read_image_size(file_path)
+    return _decode(lambda flag: cv2.imread(file_path, flag), size,
+                   resize_width, resize_height, max_dimension, max_pixels)
+
+
+def decode_image(buffer, resize_width=None, resize_height=None, max_dimension=None, max_pixels=None):
+    # load_image for an encoded image already in memory; the buffer is wrapped, not copied
+    array = np.frombuffer(buffer, dtype=np.uint8)
+    return _decode(lambda flag: cv2.imdecode(array, flag), image_size(buffer),
+                   resize_width, resize_height, max_dimension, max_pixels)
+
+
+def _decode(read, size, resize_width, resize_height, max_dimension, max_pixels):
+    if size is None:
+        # Without the dimensions the pixel limit cannot be checked before decoding, so
+        # only decode blind when there is no limit to enforce
+        if max_pixels:
+            raise ValueError("Could not read image size")
+        image = read(cv2.IMREAD_COLOR)
+    else:
+        # size is the decoded size (see image_size), EXIF rotation included
+        width, height = size
+        target = target_size(width, height, resize_width, resize_height, max_dimension)
+        factor, flag = _reduction(size, target)
+        if max_pixels and (width // factor) * (height // factor) > max_pixels:
+            raise ValueError(f"Image too large: {width}x{height}")
+        image = read(flag)
+        if image is not None:
+            image = resize_tiled(image, target)
+    if image is None:
+        raise ValueError("Could not decode image")
+    return image
+
+
+def _reduction(size, target):
+    # Largest reduction that still decodes at least the target resolution
+    for factor, flag in REDUCED_FLAGS:
+        if size[0] // factor >= target[0] and size[1] // factor >= target[1]:
+            return factor, flag
+    return 1, cv2.IMREAD_COLOR
+
+
+def resize_tiled(image, size):
+    width, height = size
+    if (image.shape[1], image.shape[0]) == (width, height):
+        return image
+    interpolation = cv2.INTER_AREA if width < image.shape[1] else cv2.INTER_CUBIC
+    if image.shape[0] * image.shape[1] <= TILE_PIXELS:
+        return cv2.resize(image, (width, height), interpolation=interpolation)
+
+    # Resize band by band so only one strip of intermediate data exists at a time
+    output = np.empty((height, width) + image.shape[2:], dtype=image.dtype)
+    scale_y = image.shape[0] / height
+    out_rows = max(1, int(TILE_ROWS / scale_y))
+    for top in range(0, height, out_rows):
+        bottom = min(top + out_rows, height)
+        src_top = int(top * scale_y)
+        src_bottom = min(image.shape[0], max(src_top + 1, int(round(bottom * scale_y))))
+        output[top:bottom] = cv2.resize(image[src_top:src_bottom], (width, bottom - top),
+                                        interpolation=interpolation)
+    return output
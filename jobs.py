@@ -0,0 +1,280 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from backends import worker_context
+from metrics import Trace
+from storage import thread_connection
+
+# Job states reported by the /jobs endpoints
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def run_traced(func, *args):
+    # Runs in the worker process; stage timings travel back to the parent with the result
+    with Trace() as trace:
+        result = func(*args)
+    return result, trace.stages
+
+
+class Job:
+    def __init__(self, kind, output_format):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.output_format = output_format
+        self.future = None
+        self.callbacks = []
+        self._lock = threading.Lock()
+        self.result = None
+        self.stages = {}
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        # Set once the job has been handed to the pool (or needs no pool at all)
+        self._submitted = threading.Event()
+        # Last status saved by the process running the job, for jobs loaded from a JobStore
+        self._stored_status = None
+
+    @property
+    def status(self):
+        if self.finished is not None:
+            return FAILED if self.error else DONE
+        if self.future is not None:
+            # Handed to the pool, which is the state other processes see saved (a worker
+            # may take a moment to pick it up)
+            return RUNNING
+        return self._stored_status or QUEUED
+
+    def wait(self, timeout=None):
+        # Block until the converter finishes and return the converted file name.
+        # Jobs held back by admission control have no future until they are started.
+        if self._submitted.wait(timeout) and self.future is not None:
+            self.future.exception(timeout=timeout)
+            self._complete(self.future)
+        return self.result
+
+    def _complete(self, future):
+        # Called from the pool's callback thread and from wait(); only the first call counts
+        with self._lock:
+            if self.finished is not None:
+                return
+            try:
+                self.result, self.stages = future.result()
+                if self.result is None:
+                    self.error = f"Error converting {self.kind}"
+            except Exception as e:
+                self.error = str(e) or e.__class__.__name__
+            # Callbacks may replace the result before the job is reported as finished
+            for callback in self.callbacks:
+                try:
+                    callback(self)
+                except Exception as e:
+                    print(f"Error in job callback: {e}")
+            self.finished = time.time()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'format': self.output_format,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'stages': self.stages,
+            'created': self.created,
+            'finished': self.finished,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data['kind'], data['format'])
+        job.id = data['id']
+        job.result = data['result']
+        job.error = data['error']
+        job.stages = data['stages']
+        job.created = data['created']
+        job.finished = data['finished']
+        job._stored_status = data['status']
+        return job
+
+
+class JobStore:
+    # Job states shared through an SQLite file by every process serving the app, so a
+    # job submitted to one web worker can be polled through any other. Records are
+    # dropped max_age seconds after their last update.
+
+    PRUNE_INTERVAL = 60
+
+    def __init__(self, path, max_age=24 * 60 * 60):
+        self.path = path
+        self.max_age = max_age
+        self._local = threading.local()
+        self._last_prune = 0
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, data TEXT NOT NULL, '
+                               'updated REAL NOT NULL)')
+
+    def _connect(self):
+        return thread_connection(self._local, self.path)
+
+    def save(self, job):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO jobs (id, data, updated) VALUES (?, ?, ?)',
+                               (job.id, json.dumps(job.to_dict()), now))
+            if now - self._last_prune > self.PRUNE_INTERVAL:
+                self._last_prune = now
+                connection.execute('DELETE FROM jobs WHERE updated < ?', (now - self.max_age,))
+
+    def load(self, job_id):
+        row = self._connect().execute('SELECT data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return Job.from_dict(json.loads(row['data'])) if row is not None else None
+
+
+class JobQueue:
+    def __init__(self, max_workers=None, max_jobs=1000, initializer=None, initargs=(), store=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        # Runs once in every worker process, e.g. to import the converter libraries
+        self.initializer = initializer
+        self.initargs = initargs
+        # Optional JobStore that makes this queue's jobs visible to other processes
+        self.store = store
+        self._executor = None
+        self._closed = False
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # The pool is started on first use so importing the app does not fork workers
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=worker_context(),
+                                                 initializer=self.initializer, initargs=self.initargs)
+        return self._executor
+
+    def submit(self, kind, output_format, func, *args, on_complete=None, limit=None):
+        # With a limit (see admission.py) the job only reaches the pool once it gets a
+        # slot; until then it is reported as queued. Raises admission.Overloaded when
+        # the limit's queue is full.
+        if self._closed:
+            raise RuntimeError("Conversion pool is shut down")
+        job = Job(kind, output_format)
+        if on_complete is not None:
+            job.callbacks.append(on_complete)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._save(job)
+        if limit is None:
+            self._start(job, func, args)
+            return job
+
+        def release_slot(job):
+            # A job that failed to start never reached the pool; the limit took its slot back itself
+            if job.future is not None:
+                limit.release(time.time() - job.started)
+
+        job.callbacks.append(release_slot)
+        try:
+            limit.start_or_queue(lambda: self._start(job, func, args), on_error=lambda e: self._fail(job, e))
+        except Exception:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise
+        return job
+
+    def _start(self, job, func, args):
+        job.started = time.time()
+        with self._lock:
+            if self._closed:
+                # A queued job reaching its slot after shutdown(); the limit fails it
+                raise RuntimeError("Conversion pool is shut down")
+            executor = self._get_executor()
+            try:
+                future = executor.submit(run_traced, func, *args)
+            except BrokenProcessPool:
+                # The pool broke before its jobs' callbacks could replace it; this job
+                # never ran, so it goes to a fresh pool
+                self._drop_executor(executor)
+                executor = self._get_executor()
+                future = executor.submit(run_traced, func, *args)
+            job.future = future
+        job._submitted.set()
+        self._save(job)
+        future.add_done_callback(lambda future: self._finish(job, future, executor))
+
+    def _finish(self, job, future, executor):
+        # A worker that died (out of memory, a crash in a native library) breaks the whole
+        # pool: every job still in it fails, and the next one starts a new pool
+        if isinstance(future.exception(), BrokenProcessPool):
+            with self._lock:
+                self._drop_executor(executor)
+        job._complete(future)
+        self._save(job)
+
+    def _fail(self, job, error):
+        # Finish a job that could not be handed to the pool, e.g. after shutdown
+        future = Future()
+        future.set_exception(error)
+        job._complete(future)
+        job._submitted.set()
+        self._save(job)
+
+    def _drop_executor(self, executor):
+        # Called with self._lock held
+        if self._executor is executor:
+            self._executor = None
+            executor.shutdown(wait=False)
+
+    def _save(self, job):
+        if self.store is not None:
+            try:
+                self.store.save(job)
+            except Exception as e:
+                print(f"Error saving job {job.id}: {e}")
+
+    def completed(self, kind, output_format, result):
+        # Register a job whose output already exists, e.g. a conversion cache hit
+        job = Job(kind, output_format)
+        job.result = result
+        job.finished = job.created
+        job._submitted.set()
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._save(job)
+        return job
+
+    def _prune(self):
+        # Forget the oldest finished jobs once the table is full
+        if len(self._jobs) <= self.max_jobs:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished is not None]:
+            del self._jobs[job_id]
+            if len(self._jobs) <= self.max_jobs:
+                break
+
+    def get(self, job_id):
+        # Jobs of this process first, then those other processes have saved to the store
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = self.store.load(job_id)
+        return job
+
+    def shutdown(self, wait=True):
+        # No job starts after this; running ones finish first when wait is true
+        with self._lock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,249 @@
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the histogram buckets, from quick image encodes up to long audio
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+REGISTRY = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def snapshot(self):
+        # [[label values, value], ...], JSON-serializable for merging with other processes'
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def combine(self, value, other):
+        # One sample from two processes' snapshots
+        return value + other
+
+    def render(self, values=None):
+        # values: {label values: value} merged from snapshots, instead of this process's own
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        if values is None:
+            with self._lock:
+                lines.extend(self._render_samples(key, value) for key, value in sorted(self._values.items()))
+        else:
+            lines.extend(self._render_samples(key, value) for key, value in sorted(values.items()))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_samples(self, key, value):
+        return f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), merge='sum', registry=REGISTRY):
+        # merge is how the values of several processes add up: 'sum' for per-process state,
+        # 'max' for state they all observe alike (e.g. a shared folder)
+        super().__init__(name, documentation, labels, registry)
+        self.merge = merge
+
+    def combine(self, value, other):
+        return max(value, other) if self.merge == 'max' else value + other
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    _render_samples = Counter._render_samples
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, documentation, labels, registry)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def snapshot(self):
+        # Copies the bucket counts, which observe() updates in place
+        with self._lock:
+            return [[list(key), [list(counts), total]] for key, (counts, total) in self._values.items()]
+
+    def combine(self, value, other):
+        return [a + b for a, b in zip(value[0], other[0])], value[1] + other[1]
+
+    def _render_samples(self, key, value):
+        counts, total = value
+        lines = [f'{self.name}_bucket{_format_labels(self.labels, key, [("le", _format_value(bound))])} {count}'
+                 for bound, count in zip(self.buckets, counts)]
+        lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}')
+        lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {counts[-1]}')
+        return '\n'.join(lines)
+
+
+def render_metrics(registry=REGISTRY, values=None):
+    # Prometheus text exposition format, version 0.0.4. values ({metric name: {label
+    # values: value}}, see merge_snapshots) replaces this process's own samples.
+    if values is None:
+        return '\n'.join(metric.render() for metric in registry) + '\n'
+    return '\n'.join(metric.render(values.get(metric.name, {})) for metric in registry) + '\n'
+
+
+def snapshot(registry=REGISTRY, gauges=True):
+    # {metric name: samples} of this process; without gauges, only what stays meaningful
+    # after the process is gone
+    return {metric.name: metric.snapshot() for metric in registry if gauges or metric.type != 'gauge'}
+
+
+def merge_snapshots(snapshots, registry=REGISTRY):
+    # Combine snapshots of several processes into {metric name: {label values: value}}
+    metrics = {metric.name: metric for metric in registry}
+    merged = {name: {} for name in metrics}
+    for data in snapshots:
+        for name, samples in data.items():
+            metric = metrics.get(name)
+            if metric is None:
+                continue
+            values = merged[name]
+            for key, value in samples:
+                key = tuple(key)
+                values[key] = metric.combine(values[key], value) if key in values else value
+    return merged
+
+
+STAGE_SECONDS = Histogram('conversion_stage_seconds', 'Time spent in each stage of a conversion.', ['stage'])
+CONVERSION_SECONDS = Histogram('conversion_seconds', 'Time from submitting a conversion job to its completion.',
+                               ['kind', 'status'])
+REQUEST_SECONDS = Histogram('http_request_seconds', 'Time to produce each HTTP response.', ['endpoint', 'status'])
+UPLOAD_BYTES = Counter('upload_bytes_total', 'Bytes received in uploaded files.', ['file_type'])
+CONVERTED_BYTES = Counter('converted_bytes_total', 'Bytes written by finished conversions.', ['kind'])
+RESPONSE_BYTES = Counter('http_response_bytes_total', 'Bytes sent in responses of known length.', ['endpoint'])
+CACHE_REQUESTS = Counter('conversion_cache_requests_total', 'Conversion cache lookups.', ['result'])
+CONVERSION_FAILURES = Counter('conversion_failures_total', 'Conversions that produced no output.', ['kind'])
+ADMISSION_ACTIVE = Gauge('admission_active', 'Conversions holding a concurrency slot.', ['kind'])
+ADMISSION_QUEUED = Gauge('admission_queued', 'Conversions waiting for a concurrency slot.', ['kind'])
+ADMISSION_REJECTIONS = Counter('admission_rejections_total', 'Conversions turned away by admission control.',
+                               ['kind', 'reason'])
+# Every process sweeping a folder sees the same files, so these are not added up across processes
+STORAGE_FILES = Gauge('storage_files', 'Files in each storage folder at the last sweep.', ['folder'], merge='max')
+STORAGE_BYTES = Gauge('storage_bytes', 'Bytes in each storage folder at the last sweep.', ['folder'], merge='max')
+STORAGE_REMOVED = Counter('storage_removed_files_total', 'Files removed by expiry or quota eviction.',
+                          ['folder', 'reason'])
+
+
+_current_trace = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    # Collects stage timings for one request or one conversion job. Stages entered more
+    # than once (e.g. per page) are summed.
+
+    def __init__(self):
+        self.stages = {}
+        self.started = time.perf_counter()
+        self._token = None
+
+    def start(self):
+        self._token = _current_trace.set(self)
+        return self
+
+    def stop(self):
+        if self._token is not None:
+            _current_trace.reset(self._token)
+            self._token = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+@contextmanager
+def stage(name):
+    # Time a block against the current trace; outside a trace this only costs two clock reads
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, time.perf_counter() - start)
+
+
+def timed_iter(iterable, name):
+    # Yield from iterable, timing only the work done to produce each item
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def observe_stages(stages):
+    for name, seconds in stages.items():
+        STAGE_SECONDS.observe(seconds, stage=name)
+
+
+class TraceLog:
+    # Appends one JSON object per line; shared by request threads and job callbacks
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, separators=(',', ':'), default=str) + '\n'
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as log_file:
+                log_file.write(line)
@@ -0,0 +1,128 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+from metrics import REGISTRY, merge_snapshots, render_metrics, snapshot
+from storage import thread_connection
+
+# Row holding the counters and histograms of processes that have exited
+ARCHIVE = 'archive'
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsStore:
+    # Metrics of every process serving the app, shared through an SQLite file so that a
+    # scrape of /metrics answered by any one web worker reports the whole server. Each
+    # process writes a snapshot of its registry every `interval` seconds and whenever it
+    # is scraped, so the other workers' samples are at most that old. Counters and
+    # histograms are added up; gauges are combined as each declares (see metrics.Gauge),
+    # from processes that saved within the last few intervals only. When a process exits,
+    # its counters and histograms are folded into one archived row, so totals do not go
+    # backwards when gunicorn replaces a worker.
+
+    STALE_INTERVALS = 3
+
+    def __init__(self, path, interval=5, registry=REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._local = threading.local()
+        self._token = None
+        self._pid = None
+        self._thread = None
+        self._stop = threading.Event()
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS processes (token TEXT PRIMARY KEY, pid INTEGER NOT NULL, '
+                               'data TEXT NOT NULL, updated REAL NOT NULL)')
+
+    def _connect(self):
+        return thread_connection(self._local, self.path)
+
+    def token(self):
+        # One row per process; a forked child starts its own rather than overwriting its parent's
+        if self._pid != os.getpid():
+            self._token = uuid.uuid4().hex
+            self._pid = os.getpid()
+        return self._token
+
+    def save(self):
+        data = json.dumps(snapshot(self.registry))
+        with self._connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO processes (token, pid, data, updated) VALUES (?, ?, ?, ?)',
+                               (self.token(), os.getpid(), data, time.time()))
+
+    def collect(self):
+        # {metric name: {label values: value}} over every process, this one up to date
+        self.save()
+        rows = self._connect().execute('SELECT token, pid, data, updated FROM processes WHERE token != ?',
+                                       (ARCHIVE,)).fetchall()
+        snapshots = []
+        for row in rows:
+            if not pid_alive(row['pid']):
+                self._archive(row['token'])
+                continue
+            data = json.loads(row['data'])
+            if row['updated'] < time.time() - self.STALE_INTERVALS * self.interval:
+                # A process that stopped saving; its gauges no longer describe anything
+                data = self._without_gauges(data)
+            snapshots.append(data)
+        # Read after archiving, so it includes the processes just folded in
+        archive = self._connect().execute('SELECT data FROM processes WHERE token = ?', (ARCHIVE,)).fetchone()
+        if archive is not None:
+            snapshots.append(json.loads(archive['data']))
+        return merge_snapshots(snapshots, self.registry)
+
+    def _without_gauges(self, data):
+        gauges = {metric.name for metric in self.registry if metric.type == 'gauge'}
+        return {name: samples for name, samples in data.items() if name not in gauges}
+
+    def _archive(self, token):
+        # Deleting the row first takes the write lock, so of several processes finding
+        # the same exited one, only the first adds its totals to the archive
+        with self._connect() as connection:
+            row = connection.execute('SELECT data FROM processes WHERE token = ?', (token,)).fetchone()
+            if row is None or connection.execute('DELETE FROM processes WHERE token = ?', (token,)).rowcount != 1:
+                return
+            archive = connection.execute('SELECT data FROM processes WHERE token = ?', (ARCHIVE,)).fetchone()
+            snapshots = [self._without_gauges(json.loads(row['data']))]
+            if archive is not None:
+                snapshots.append(json.loads(archive['data']))
+            merged = merge_snapshots(snapshots, self.registry)
+            data = {name: [[list(key), value] for key, value in values.items()] for name, values in merged.items()}
+            connection.execute('INSERT OR REPLACE INTO processes (token, pid, data, updated) VALUES (?, 0, ?, ?)',
+                               (ARCHIVE, json.dumps(data), time.time()))
+
+    def render(self):
+        return render_metrics(self.registry, self.collect())
+
+    def start(self):
+        # Save now and then every interval seconds from a daemon thread
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        def run():
+            while True:
+                try:
+                    self.save()
+                except Exception as e:
+                    print(f"Error saving metrics: {e}")
+                if self._stop.wait(self.interval):
+                    return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name='metrics-store', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
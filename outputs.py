@@ -0,0 +1,77 @@
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+
+# Names handed out below start with a uuid4 hex, optionally hidden while still being written.
+# Cleanup only ever touches files named this way.
+GENERATED_NAME = re.compile(r'^\.?[0-9a-f]{32}')
+
+
+def unique_name(ext):
+    return f'{uuid.uuid4().hex}.{ext}'
+
+
+class OutputFile:
+    def __init__(self, folder, ext):
+        self.name = unique_name(ext)
+        self.final_path = os.path.join(folder, self.name)
+        # Keep the extension so converters that infer the format from the path still work
+        self.path = os.path.join(folder, f'.{self.name[:-len(ext) - 1]}.tmp.{ext}')
+
+
+@contextmanager
+def atomic_output(folder, ext):
+    # Converters write to output.path; it is renamed into place only once complete,
+    # so readers never see a partial file
+    output = OutputFile(folder, ext)
+    try:
+        yield output
+        os.replace(output.path, output.final_path)
+    except BaseException:
+        remove_file(output.path)
+        raise
+
+
+def remove_file(file_path):
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
+
+
+def cleanup_folder(folder, max_age, keep=()):
+    # Delete generated files older than max_age seconds, except the names in keep
+    cutoff = time.time() - max_age
+    removed = 0
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not GENERATED_NAME.match(entry.name) or entry.name in keep:
+                continue
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+class ChunkBuffer:
+    # Write-only file object collecting bytes until the next drain(), used to stream
+    # archives built with zipfile as a chunked response
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
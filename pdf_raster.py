@@ -0,0 +1,39 @@
+import cv2
+import fitz
+import numpy as np
+
+# PDF points per inch; fitz lays pages out in points
+POINTS_PER_INCH = 72
+
+
+def open_pdf(source):
+    # A path, or the bytes of an upload that is still in memory
+    if isinstance(source, str):
+        return fitz.open(source)
+    return fitz.open(stream=source, filetype='pdf')
+
+
+def pixmap_to_image(pixmap):
+    # View the pixmap's RGB samples as an array (rows may be padded to the stride) and
+    # convert to the BGR layout OpenCV encodes from. The conversion is the only copy out
+    # of MuPDF's buffer; the pixels are never written out and decoded again.
+    rows = np.frombuffer(pixmap.samples_mv, dtype=np.uint8).reshape(pixmap.height, pixmap.stride)
+    samples = rows[:, :pixmap.width * pixmap.n].reshape(pixmap.height, pixmap.width, pixmap.n)
+    return cv2.cvtColor(samples, cv2.COLOR_RGB2BGR)
+
+
+def render_page(source, page_number, dpi=96, max_pixels=None):
+    # Render one page (counted from 1) at the given resolution. Only that page is loaded,
+    # so the time taken does not depend on how long the document is.
+    pdf_document = open_pdf(source)
+    try:
+        if not 1 <= page_number <= pdf_document.page_count:
+            raise ValueError(f"Page {page_number} is out of range (1-{pdf_document.page_count})")
+        page = pdf_document.load_page(page_number - 1)
+        scale = dpi / POINTS_PER_INCH
+        if max_pixels and page.rect.width * scale * page.rect.height * scale > max_pixels:
+            raise ValueError(f"Page {page_number} at {dpi} dpi is larger than {max_pixels} pixels")
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+        return pixmap_to_image(pixmap)
+    finally:
+        pdf_document.close()
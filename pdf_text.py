@@ -0,0 +1,71 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+
+from backends import worker_context
+
+# Each worker gets several small page ranges so results can be yielded in order early
+RANGES_PER_WORKER = 4
+
+
+def page_paragraphs(page):
+    # Text blocks in reading order, one paragraph per block
+    return [block[4].strip() for block in page.get_text('blocks', sort=True)
+            if block[6] == 0 and block[4].strip()]
+
+
+def extract_page_range(file_path, start, stop, extract):
+    # Runs in a worker process, which opens its own handle on the document
+    pdf_document = fitz.open(file_path)
+    try:
+        return [extract(pdf_document.load_page(page_number)) for page_number in range(start, stop)]
+    finally:
+        pdf_document.close()
+
+
+def page_count(file_path):
+    # Opening a document only reads its page tree, so this is cheap even for long PDFs
+    pdf_document = fitz.open(file_path)
+    try:
+        return pdf_document.page_count
+    finally:
+        pdf_document.close()
+
+
+def page_ranges(page_count, parts):
+    size = max(1, -(-page_count // parts))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def iter_pdf_paragraphs(file_path, workers=1, parallel_min_pages=64):
+    # Yield the paragraphs of each page in order, so callers can write or send them page
+    # by page instead of holding the whole document in memory.
+    # Documents with at least parallel_min_pages pages are sharded across worker processes.
+    return iter_pdf_pages(file_path, page_paragraphs, workers, parallel_min_pages)
+
+
+def iter_pdf_pages(file_path, extract, workers=1, parallel_min_pages=64):
+    pdf_document = fitz.open(file_path)
+    page_count = pdf_document.page_count
+    if workers > 1 and page_count >= parallel_min_pages:
+        pdf_document.close()
+        yield from _iter_pdf_pages_parallel(file_path, page_count, extract, workers)
+        return
+
+    try:
+        for page_number in range(page_count):
+            yield extract(pdf_document.load_page(page_number))
+    finally:
+        pdf_document.close()
+
+
+def _iter_pdf_pages_parallel(file_path, page_count, extract, workers):
+    with ProcessPoolExecutor(max_workers=workers, mp_context=worker_context()) as executor:
+        futures = [executor.submit(extract_page_range, file_path, start, stop, extract)
+                   for start, stop in page_ranges(page_count, workers * RANGES_PER_WORKER)]
+        try:
+            for future in futures:
+                yield from future.result()
+        finally:
+            for future in futures:
+                future.cancel()
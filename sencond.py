@@ -4,7 +4,6 @@ from pydub import AudioSegment
 import cv2
 from werkzeug.utils import secure_filename
 import fitz
-import docx2pdf  # Added import for docx2pdf
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
@@ -36,6 +35,7 @@ def convert_docx_to_pdf(file_path, output_format):
         if output_format == 'pdf':
             # Convert DOCX to PDF using docx2pdf
             converted_file_path = os.path.join(app.config['CONVERTED_FOLDER'], 'converted.pdf')
+            import docx2pdf  # Imported here so startup does not pay for it
             docx2pdf.convert(file_path, converted_file_path)
             return 'converted.pdf'
         elif output_format == 'doc':
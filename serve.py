@@ -0,0 +1,91 @@
+# Production entry point, in place of the debug server: gunicorn with preforked web
+# workers, each serving requests from a pool of threads (the gthread worker). Reading a
+# slow upload or sending a download only occupies a thread, which waits on the socket
+# without holding the GIL, and downloads go out through sendfile(); the CPU-bound
+# conversions run in each worker's conversion pool. Settings come from the environment:
+#
+#     WEB_BIND=0.0.0.0:8000 WEB_WORKERS=4 WEB_THREADS=32 python serve.py
+#
+# Send SIGHUP to the master for a graceful reload: new workers start with the current
+# code and settings while the old ones finish their requests and running conversions
+# (for at most WEB_GRACEFUL_TIMEOUT seconds); conversions still queued for a slot fail.
+# /metrics adds up the metrics of all workers. gunicorn is an optional dependency, only
+# needed here: pip install gunicorn
+import os
+import sys
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    sys.exit('serve.py needs gunicorn: pip install gunicorn')
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def worker_exit(server, worker):
+    # Jobs still queued for a slot would never start once the pool is shut down, and
+    # other workers would report them as queued forever: fail them, then let conversions
+    # this worker started finish before it goes away. Its final metrics are saved for
+    # the workers that stay.
+    version = sys.modules.get('version')
+    if version is not None:
+        error = RuntimeError("Server restarted before the conversion started")
+        for limit in version.limits.values():
+            limit.cancel_waiting(error)
+        version.jobs.shutdown(wait=True)
+        version.metrics_store.stop()
+        version.metrics_store.save()
+
+
+def server_options():
+    workers = env_int('WEB_WORKERS', 2)
+    return {
+        'bind': os.environ.get('WEB_BIND', '0.0.0.0:8000').split(','),
+        'workers': workers,
+        'worker_class': os.environ.get('WEB_WORKER_CLASS', 'gthread'),
+        'threads': env_int('WEB_THREADS', 32),
+        # Seconds a worker may go without checking in before it is restarted; with gthread
+        # the check-in does not wait for slow requests to finish
+        'timeout': env_int('WEB_TIMEOUT', 60),
+        'graceful_timeout': env_int('WEB_GRACEFUL_TIMEOUT', 120),
+        'keepalive': env_int('WEB_KEEPALIVE', 5),
+        'backlog': env_int('WEB_BACKLOG', 2048),
+        # Restart each worker after this many requests (0: never), spread by the jitter
+        'max_requests': env_int('WEB_MAX_REQUESTS', 0),
+        'max_requests_jitter': env_int('WEB_MAX_REQUESTS_JITTER', 0),
+        'accesslog': os.environ.get('WEB_ACCESS_LOG'),
+        'errorlog': os.environ.get('WEB_ERROR_LOG', '-'),
+        'loglevel': os.environ.get('WEB_LOG_LEVEL', 'info'),
+        'worker_exit': worker_exit,
+    }
+
+
+class EditMonkServer(BaseApplication):
+    # The app is imported in each worker rather than in the master, so a reload picks up new code
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for name, value in self.options.items():
+            if value is not None:
+                self.cfg.set(name, value)
+
+    def load(self):
+        from version import app
+        return app
+
+
+def main():
+    options = server_options()
+    # Each web worker has its own conversion pool; unless told otherwise, split the cores
+    # between them instead of starting a full-size pool in every worker
+    os.environ.setdefault('CONVERSION_WORKERS', str(max(1, (os.cpu_count() or 1) // options['workers'])))
+    EditMonkServer(options).run()
+
+
+if __name__ == '__main__':
+    main()
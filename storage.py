@@ -0,0 +1,240 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from metrics import STORAGE_FILES, STORAGE_BYTES, STORAGE_REMOVED
+from outputs import cleanup_folder, remove_file
+
+INDEX_NAME = '.storage.sqlite3'
+# Last-access times are only rewritten once they are this old (seconds), so a file that
+# is read over and over does not turn every read into a write
+TOUCH_INTERVAL = 60
+# Rows read at a time while evicting
+EVICT_BATCH = 256
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    key TEXT,
+    size INTEGER NOT NULL,
+    sha256 TEXT,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_key ON files (key);
+CREATE INDEX IF NOT EXISTS files_accessed ON files (accessed);
+'''
+
+
+def thread_connection(local, path):
+    # One connection per thread, and a new one in a forked child, to an SQLite file in WAL
+    # mode so that readers in other processes never block on a writer
+    connection = getattr(local, 'connection', None)
+    if connection is None or local.pid != os.getpid():
+        connection = sqlite3.connect(path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        local.connection = connection
+        local.pid = os.getpid()
+    return connection
+
+
+class Storage:
+    # Files are kept two directory levels down, under the first four characters of their
+    # name (converted/3f/a2/3fa2....png), so no directory grows past a few thousand entries.
+    # An SQLite index in the folder records each file's size and last access: expiry
+    # (max_age seconds without access) and the quota (max_bytes, max_entries; least
+    # recently used files go first) are queries on it rather than walks over the tree,
+    # and every process sharing the folder sees the same index. Files removed without
+    # going through the index are dropped from it by the next sweep. Files a process holds
+    # (see hold()) do not expire while it runs.
+
+    def __init__(self, folder, max_age=None, max_bytes=None, max_entries=None):
+        self.folder = os.path.abspath(folder)
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.index_path = os.path.join(folder, INDEX_NAME)
+        self._local = threading.local()
+        self._sweeper = None
+        self._stop = threading.Event()
+        self._held = {}
+        self._held_lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        return thread_connection(self._local, self.index_path)
+
+    def path(self, name):
+        # Where a stored name lives, or None for anything but a plain file name
+        if not name or name != os.path.basename(name) or name.startswith('.'):
+            return None
+        return os.path.join(self.folder, name[:2], name[2:4], name)
+
+    def new_path(self, filename):
+        # A collision-free path for an incoming file. It is indexed at once, so it expires
+        # even if nothing ever finishes with it.
+        name = f'{uuid.uuid4().hex}_{filename}'
+        file_path = self.path(name)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        self._record(name, 0)
+        return file_path
+
+    def record(self, file_path, size):
+        # Index the final size of a file from new_path once it has been written
+        with self._connect() as connection:
+            connection.execute('UPDATE files SET size = ?, accessed = ? WHERE name = ?',
+                               (size, time.time(), os.path.basename(file_path)))
+
+    def put(self, source_path, name, key=None, sha256=None):
+        # Move a finished file into place under name, then evict if over the quota
+        file_path = self.path(name)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.replace(source_path, file_path)
+        self._record(name, os.path.getsize(file_path), key, sha256)
+        self.evict()
+        return name
+
+    def _record(self, name, size, key=None, sha256=None):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO files (name, key, size, sha256, created, accessed) '
+                               'VALUES (?, ?, ?, ?, ?, ?)', (name, key, size, sha256, now, now))
+
+    def find(self, key):
+        # Name of the newest file stored under key, counted as an access
+        row = self._connect().execute('SELECT name FROM files WHERE key = ? ORDER BY created DESC LIMIT 1',
+                                      (key,)).fetchone()
+        if row is None:
+            return None
+        if not os.path.exists(self.path(row['name'])):
+            self.forget(row['name'])
+            return None
+        self.touch(row['name'])
+        return row['name']
+
+    def info(self, name):
+        row = self._connect().execute('SELECT * FROM files WHERE name = ?', (name,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def touch(self, name):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute('UPDATE files SET accessed = ? WHERE name = ? AND accessed < ?',
+                               (now, name, now - TOUCH_INTERVAL))
+
+    def discard(self, file_path):
+        # Remove a file handed out by new_path once it is no longer needed
+        remove_file(file_path)
+        with self._held_lock:
+            self._held.pop(os.path.basename(file_path), None)
+        self.forget(os.path.basename(file_path))
+
+    def hold(self, file_path):
+        # Keep a file from expiring while this process still needs it, e.g. the input of a
+        # queued or running conversion, however long that takes. Every sweep marks held files
+        # as just accessed in the shared index, so the other processes' sweepers keep them
+        # too; the holds of a process that dies lapse with it.
+        name = os.path.basename(file_path)
+        with self._held_lock:
+            self._held[name] = self._held.get(name, 0) + 1
+        self._refresh([name])
+
+    def release(self, file_path):
+        # Undo one hold(); the file expires as usual once nothing holds it
+        name = os.path.basename(file_path)
+        with self._held_lock:
+            count = self._held.pop(name, 0) - 1
+            if count > 0:
+                self._held[name] = count
+
+    def _refresh(self, names):
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany('UPDATE files SET accessed = ? WHERE name = ?', [(now, name) for name in names])
+
+    def forget(self, name):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM files WHERE name = ?', (name,))
+
+    def remove(self, names, reason):
+        for name in names:
+            remove_file(self.path(name))
+        with self._connect() as connection:
+            connection.executemany('DELETE FROM files WHERE name = ?', [(name,) for name in names])
+        if names:
+            STORAGE_REMOVED.inc(len(names), folder=self.folder, reason=reason)
+        return len(names)
+
+    def usage(self):
+        # (number of files, total bytes)
+        row = self._connect().execute('SELECT COUNT(*), TOTAL(size) FROM files').fetchone()
+        return row[0], int(row[1])
+
+    def expire(self):
+        if self.max_age is None:
+            return 0
+        cutoff = time.time() - self.max_age
+        rows = self._connect().execute('SELECT name FROM files WHERE accessed < ?', (cutoff,)).fetchall()
+        return self.remove([row['name'] for row in rows], 'expired')
+
+    def evict(self):
+        # Remove least recently used files until both caps are met; the most recently used file always stays
+        if self.max_bytes is None and self.max_entries is None:
+            return 0
+        count, size = self.usage()
+        removed = 0
+        while count > 1 and ((self.max_entries is not None and count > self.max_entries)
+                             or (self.max_bytes is not None and size > self.max_bytes)):
+            rows = self._connect().execute('SELECT name, size FROM files ORDER BY accessed LIMIT ?',
+                                           (min(EVICT_BATCH, count - 1),)).fetchall()
+            names = []
+            for row in rows:
+                if count <= 1 or ((self.max_entries is None or count <= self.max_entries)
+                                  and (self.max_bytes is None or size <= self.max_bytes)):
+                    break
+                names.append(row['name'])
+                count -= 1
+                size -= row['size']
+            if not names:
+                break
+            removed += self.remove(names, 'evicted')
+        return removed
+
+    def sweep(self):
+        # Expire, evict, and clear files a crash left half-written at the top level
+        with self._held_lock:
+            held = list(self._held)
+        self._refresh(held)
+        removed = self.expire() + self.evict()
+        if self.max_age is not None:
+            removed += cleanup_folder(self.folder, self.max_age)
+        count, size = self.usage()
+        STORAGE_FILES.set(count, folder=self.folder)
+        STORAGE_BYTES.set(size, folder=self.folder)
+        return removed
+
+    def start_sweeper(self, interval):
+        # Sweep now and then every interval seconds from a daemon thread
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+
+        def run():
+            while True:
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"Error sweeping {self.folder}: {e}")
+                if self._stop.wait(interval):
+                    return
+
+        self._stop.clear()
+        self._sweeper = threading.Thread(target=run, name=f'sweeper-{self.folder}', daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stop.set()
@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+import admission
+from admission import ConcurrencyLimit, Overloaded
+
+
+def test_starts_until_concurrency_then_queues():
+    limit = ConcurrencyLimit('test', concurrency=2, queue_size=2)
+    started = []
+    for number in range(4):
+        limit.start_or_queue(lambda number=number: started.append(number))
+    assert started == [0, 1]
+    assert limit._active == 2
+    assert len(limit._waiting) == 2
+
+
+def test_release_hands_slot_to_next_waiter_in_order():
+    limit = ConcurrencyLimit('test', concurrency=1, queue_size=2)
+    started = []
+    for number in range(3):
+        limit.start_or_queue(lambda number=number: started.append(number))
+    limit.release()
+    assert started == [0, 1]
+    # The slot passed straight over, so it is still held
+    assert limit._active == 1
+    limit.release()
+    limit.release()
+    assert started == [0, 1, 2]
+    assert limit._active == 0
+
+
+def test_full_queue_is_rejected_with_429_and_retry_after():
+    limit = ConcurrencyLimit('test', concurrency=1, queue_size=1)
+    limit.start_or_queue(lambda: None)
+    limit.start_or_queue(lambda: None)
+    with pytest.raises(Overloaded) as rejected:
+        limit.start_or_queue(lambda: None)
+    assert rejected.value.status == 429
+    assert rejected.value.retry_after >= 1
+    assert len(limit._waiting) == 1
+
+
+def test_retry_after_follows_queue_length_and_duration():
+    limit = ConcurrencyLimit('test', concurrency=2, queue_size=10)
+    limit.average_seconds = 4.0
+    assert limit.retry_after() == 2
+    for _ in range(2 + 3):
+        limit.start_or_queue(lambda: None)
+    # Three waiting plus the new request, two at a time
+    assert limit.retry_after() == 8
+    limit.average_seconds = 10 ** 6
+    assert limit.retry_after() == admission.MAX_RETRY_AFTER
+
+
+def test_release_updates_average_duration():
+    limit = ConcurrencyLimit('test', concurrency=1, queue_size=0)
+    limit.start_or_queue(lambda: None)
+    limit.release(11.0)
+    assert limit.average_seconds == pytest.approx(1.0 + admission.DURATION_SMOOTHING * 10.0)
+
+
+def test_acquire_times_out_with_503_and_leaves_the_queue():
+    limit = ConcurrencyLimit('test', concurrency=1, queue_size=1)
+    limit.acquire()
+    with pytest.raises(Overloaded) as rejected:
+        limit.acquire(timeout=0.01)
+    assert rejected.value.status == 503
+    assert len(limit._waiting) == 0
+    assert limit._active == 1
+
+
+def test_acquire_keeps_a_slot_handed_over_as_the_wait_times_out(monkeypatch):
+    limit = ConcurrencyLimit('test', concurrency=1, queue_size=1)
+    limit.acquire()
+
+    class LateEvent(threading.Event):
+        # The holder releases just after the wait gave up, before the waiter leaves the queue
+        def wait(self, timeout=None):
+            limit.release()
+            return False
+
+    monkeypatch.setattr(admission.threading, 'Event', LateEvent)
+    limit.acquire(timeout=0.01)
+    assert limit._active == 1
+    assert len(limit._waiting) == 0
+
+
+def test_slot_is_released_after_the_block():
+    limit = ConcurrencyLimit('test', concurrency=1, queue_size=0)
+    with limit.slot():
+        assert limit._active == 1
+    assert limit._active == 0
+
+
+def test_failing_queued_start_releases_its_slot_and_reports_the_error():
+    limit = ConcurrencyLimit('test', concurrency=1, queue_size=2)
+    errors = []
+    started = []
+    limit.start_or_queue(lambda: None)
+
+    def broken():
+        raise RuntimeError('no pool')
+
+    limit.start_or_queue(broken, on_error=errors.append)
+    limit.start_or_queue(lambda: started.append(True))
+    limit.release()
+    assert [str(error) for error in errors] == ['no pool']
+    # The slot the failed start gave back went on to the next waiter
+    assert started == [True]
+    assert limit._active == 1
+
+
+def test_cancel_waiting_fails_queued_jobs_but_keeps_blocked_requests():
+    limit = ConcurrencyLimit('test', concurrency=1, queue_size=3)
+    errors = []
+    started = []
+    limit.start_or_queue(lambda: None)
+    limit.start_or_queue(lambda: started.append(True), on_error=errors.append)
+    waiter = threading.Thread(target=limit.acquire, args=(5,))
+    waiter.start()
+    while len(limit._waiting) < 2:
+        time.sleep(0.01)
+    assert limit.cancel_waiting(RuntimeError('restarting')) == 1
+    assert [str(error) for error in errors] == ['restarting']
+    # The blocked request is still queued and gets the slot once it is released
+    limit.release()
+    waiter.join()
+    assert started == []
+    assert limit._active == 1
+    assert len(limit._waiting) == 0
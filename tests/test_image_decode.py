@@ -0,0 +1,88 @@
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+from image_decode import decode_image, image_size, load_image, read_image_size, target_size
+
+
+def encode(extension, width=40, height=30):
+    return cv2.imencode(extension, np.zeros((height, width, 3), np.uint8))[1].tobytes()
+
+
+def exif_block(orientation, order='<'):
+    # TIFF structure with one IFD holding only the orientation tag
+    magic = b'II' if order == '<' else b'MM'
+    return (magic + struct.pack(order + 'HI', 42, 8) + struct.pack(order + 'H', 1)
+            + struct.pack(order + 'HHIHH', 274, 3, 1, orientation, 0) + struct.pack(order + 'I', 0))
+
+
+def jpeg_with_orientation(orientation, width=400, height=300):
+    jpeg = encode('.jpg', width, height)
+    body = b'Exif\x00\x00' + exif_block(orientation)
+    return jpeg[:2] + b'\xff\xe1' + struct.pack('>H', len(body) + 2) + body + jpeg[2:]
+
+
+def tiff(width, height, value_type=3, order='<'):
+    # Minimal header and IFD, enough for the size parser
+    magic = b'II*\x00' if order == '<' else b'MM\x00*'
+    field = 'HH' if value_type == 3 else 'I'
+    entries = [struct.pack(order + 'HHI' + field, tag, value_type, 1, *((value, 0) if value_type == 3 else (value,)))
+               for tag, value in ((256, width), (257, height))]
+    return magic + struct.pack(order + 'IH', 8, len(entries)) + b''.join(entries) + struct.pack(order + 'I', 0)
+
+
+@pytest.mark.parametrize('extension', ['.png', '.jpg', '.bmp', '.webp', '.tiff'])
+def test_image_size_reads_header_of_encoded_images(extension):
+    assert tuple(image_size(encode(extension, 40, 30))) == (40, 30)
+
+
+def test_image_size_reads_gif_header():
+    assert image_size(b'GIF89a' + struct.pack('<HH', 640, 480) + bytes(22)) == (640, 480)
+
+
+@pytest.mark.parametrize('order', ['<', '>'])
+@pytest.mark.parametrize('value_type, width', [(3, 700), (4, 70000)])
+def test_tiff_size_reads_short_and_long_values_in_both_byte_orders(order, value_type, width):
+    assert image_size(tiff(width, 500, value_type, order)) == (width, 500)
+
+
+def test_image_size_of_unknown_or_truncated_data_is_none():
+    assert image_size(b'not an image at all, just some text') is None
+    assert image_size(b'\xff\xd8\xff\xe0') is None
+    assert image_size(b'II*\x00\xff\xff\xff\xff') is None
+
+
+def test_read_image_size_of_empty_file_is_none(tmp_path):
+    path = tmp_path / 'empty.png'
+    path.write_bytes(b'')
+    assert read_image_size(str(path)) is None
+
+
+@pytest.mark.parametrize('orientation, size', [(1, (400, 300)), (3, (400, 300)), (6, (300, 400)), (8, (300, 400))])
+def test_image_size_applies_exif_orientation_like_the_decoder(orientation, size):
+    data = jpeg_with_orientation(orientation)
+    decoded = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    assert image_size(data) == size == (decoded.shape[1], decoded.shape[0])
+
+
+def test_rotated_jpeg_keeps_its_orientation_when_loaded(tmp_path):
+    path = tmp_path / 'rotated.jpg'
+    path.write_bytes(jpeg_with_orientation(6))
+    assert load_image(str(path), max_pixels=10 ** 6).shape[:2] == (400, 300)
+    assert load_image(str(path), max_dimension=200).shape[:2] == (200, 150)
+    assert decode_image(path.read_bytes(), max_dimension=100).shape[:2] == (100, 75)
+
+
+def test_target_size_keeps_aspect_ratio_for_one_side():
+    assert target_size(400, 300, resize_width=200) == (200, 150)
+    assert target_size(400, 300, resize_height=150) == (200, 150)
+    assert target_size(400, 300, resize_width=10, resize_height=20) == (10, 20)
+
+
+def test_target_size_max_dimension_only_shrinks():
+    assert target_size(400, 300, max_dimension=200) == (200, 150)
+    assert target_size(300, 400, max_dimension=200) == (150, 200)
+    assert target_size(400, 300, max_dimension=1000) == (400, 300)
+    assert target_size(4000, 1, max_dimension=100) == (100, 1)
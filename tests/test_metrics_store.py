@@ -0,0 +1,68 @@
+import json
+
+import metrics_store
+from metrics import Counter, Gauge, Histogram, merge_snapshots, render_metrics, snapshot
+from metrics_store import ARCHIVE, MetricsStore
+
+
+def make_registry():
+    registry = []
+    counter = Counter('requests_total', 'Requests.', ['kind'], registry=registry)
+    gauge = Gauge('active', 'Active.', ['kind'], registry=registry)
+    shared = Gauge('files', 'Files.', merge='max', registry=registry)
+    histogram = Histogram('seconds', 'Seconds.', buckets=(1, 10), registry=registry)
+    return registry, counter, gauge, shared, histogram
+
+
+def add_process(store, token, pid, data, updated):
+    with store._connect() as connection:
+        connection.execute('INSERT INTO processes (token, pid, data, updated) VALUES (?, ?, ?, ?)',
+                           (token, pid, json.dumps(data), updated))
+
+
+def test_merge_adds_counters_and_histograms_and_combines_gauges():
+    registry, counter, gauge, shared, histogram = make_registry()
+    counter.inc(2, kind='image')
+    gauge.set(3, kind='image')
+    shared.set(10)
+    histogram.observe(0.5)
+    other = {'requests_total': [[['image'], 5]], 'active': [[['image'], 1]], 'files': [[[], 7]],
+             'seconds': [[[], [[0, 1, 1], 4.0]]]}
+    merged = merge_snapshots([json.loads(json.dumps(snapshot(registry))), other], registry)
+    assert merged['requests_total'] == {('image',): 7}
+    assert merged['active'] == {('image',): 4}
+    assert merged['files'] == {(): 10}
+    assert merged['seconds'] == {(): ([1, 2, 2], 4.5)}
+    text = render_metrics(registry, merged)
+    assert 'requests_total{kind="image"} 7' in text
+    assert 'seconds_count 2' in text
+
+
+def test_collect_adds_up_live_processes_and_archives_exited_ones(tmp_path, monkeypatch):
+    registry, counter, gauge, shared, histogram = make_registry()
+    store = MetricsStore(str(tmp_path / 'metrics.sqlite3'), registry=registry)
+    counter.inc(1, kind='image')
+    gauge.set(1, kind='image')
+    monkeypatch.setattr(metrics_store, 'pid_alive', lambda pid: pid != 999999)
+    now = metrics_store.time.time()
+    add_process(store, 'live', 1, {'requests_total': [[['image'], 2]], 'active': [[['image'], 2]]}, now)
+    add_process(store, 'exited', 999999, {'requests_total': [[['image'], 4]], 'active': [[['image'], 5]]}, now)
+    merged = store.collect()
+    assert merged['requests_total'] == {('image',): 7}
+    # Gauges of the exited process are gone with it
+    assert merged['active'] == {('image',): 3}
+    tokens = [row['token'] for row in store._connect().execute('SELECT token FROM processes')]
+    assert 'exited' not in tokens and ARCHIVE in tokens
+    # Totals stay the same on the next scrape
+    assert store.collect()['requests_total'] == {('image',): 7}
+
+
+def test_collect_ignores_gauges_of_processes_that_stopped_saving(tmp_path, monkeypatch):
+    registry, counter, gauge, shared, histogram = make_registry()
+    store = MetricsStore(str(tmp_path / 'metrics.sqlite3'), interval=5, registry=registry)
+    monkeypatch.setattr(metrics_store, 'pid_alive', lambda pid: True)
+    add_process(store, 'stalled', 1, {'requests_total': [[['image'], 2]], 'active': [[['image'], 2]]},
+                metrics_store.time.time() - 60)
+    merged = store.collect()
+    assert merged['requests_total'] == {('image',): 2}
+    assert merged['active'] == {}
@@ -0,0 +1,104 @@
+import os
+import time
+
+import pytest
+
+from storage import Storage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return Storage(str(tmp_path / 'store'), max_age=3600, max_entries=3, max_bytes=10)
+
+
+def store(storage, name, size=1, key=None):
+    source = os.path.join(storage.folder, f'.{name}.tmp')
+    with open(source, 'wb') as f:
+        f.write(b'x' * size)
+    return storage.put(source, name, key=key)
+
+
+def set_accessed(storage, name, accessed):
+    with storage._connect() as connection:
+        connection.execute('UPDATE files SET accessed = ? WHERE name = ?', (accessed, name))
+
+
+def names(storage):
+    return sorted(row['name'] for row in storage._connect().execute('SELECT name FROM files'))
+
+
+def test_put_shards_and_indexes(storage):
+    store(storage, 'abcdef.png', size=2, key='k')
+    assert os.path.isfile(os.path.join(storage.folder, 'ab', 'cd', 'abcdef.png'))
+    assert storage.find('k') == 'abcdef.png'
+    assert storage.usage() == (1, 2)
+
+
+def test_path_refuses_unsafe_names(storage):
+    assert storage.path('../x') is None
+    assert storage.path('.hidden') is None
+    assert storage.path('') is None
+
+
+def test_expire_removes_files_not_accessed_within_max_age(storage):
+    store(storage, 'aaaa1.bin')
+    store(storage, 'bbbb1.bin')
+    set_accessed(storage, 'aaaa1.bin', time.time() - 7200)
+    assert storage.expire() == 1
+    assert names(storage) == ['bbbb1.bin']
+    assert not os.path.exists(storage.path('aaaa1.bin'))
+
+
+def test_evict_removes_least_recently_used_beyond_max_entries(storage):
+    for number, name in enumerate(['aaaa1.bin', 'bbbb1.bin', 'cccc1.bin']):
+        store(storage, name)
+        set_accessed(storage, name, 1000 + number)
+    store(storage, 'dddd1.bin')
+    assert names(storage) == ['bbbb1.bin', 'cccc1.bin', 'dddd1.bin']
+
+
+def test_evict_removes_least_recently_used_beyond_max_bytes(storage):
+    store(storage, 'aaaa1.bin', size=4)
+    set_accessed(storage, 'aaaa1.bin', 1000)
+    store(storage, 'bbbb1.bin', size=4)
+    set_accessed(storage, 'bbbb1.bin', 2000)
+    store(storage, 'cccc1.bin', size=4)
+    assert names(storage) == ['bbbb1.bin', 'cccc1.bin']
+    assert storage.usage() == (2, 8)
+
+
+def test_evict_keeps_the_most_recent_file_even_over_quota(storage):
+    store(storage, 'aaaa1.bin', size=50)
+    assert names(storage) == ['aaaa1.bin']
+
+
+def test_held_files_do_not_expire_until_released(storage):
+    file_path = storage.new_path('upload.bin')
+    name = os.path.basename(file_path)
+    storage.hold(file_path)
+    set_accessed(storage, name, time.time() - 7200)
+    storage.sweep()
+    assert name in names(storage)
+
+    storage.release(file_path)
+    set_accessed(storage, name, time.time() - 7200)
+    storage.sweep()
+    assert name not in names(storage)
+
+
+def test_discard_drops_holds(storage):
+    file_path = storage.new_path('upload.bin')
+    storage.hold(file_path)
+    storage.hold(file_path)
+    storage.discard(file_path)
+    assert storage._held == {}
+    assert names(storage) == []
+
+
+def test_record_sets_the_size_of_a_new_path(storage):
+    file_path = storage.new_path('upload.bin')
+    assert storage.usage() == (1, 0)
+    with open(file_path, 'wb') as f:
+        f.write(b'x' * 7)
+    storage.record(file_path, 7)
+    assert storage.usage() == (1, 7)
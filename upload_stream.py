@@ -0,0 +1,177 @@
+import hashlib
+import io
+import os
+import uuid
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# Bytes kept from the start of each upload for type sniffing
+SNIFF_BYTES = 64
+
+# (offset, magic bytes, detected type); RIFF and ISO-BMFF containers are refined below
+SIGNATURES = [
+    (0, b'%PDF-', 'pdf'),
+    (0, b'\x89PNG\r\n\x1a\n', 'png'),
+    (0, b'\xff\xd8\xff', 'jpeg'),
+    (0, b'GIF87a', 'gif'),
+    (0, b'GIF89a', 'gif'),
+    (0, b'BM', 'bmp'),
+    (0, b'II*\x00', 'tiff'),
+    (0, b'MM\x00*', 'tiff'),
+    (0, b'PK\x03\x04', 'zip'),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'ole'),
+    (0, b'ID3', 'mp3'),
+    (0, b'fLaC', 'flac'),
+    (0, b'OggS', 'ogg'),
+    (0, b'\x1aE\xdf\xa3', 'webm'),
+]
+
+RIFF_TYPES = {b'WEBP': 'webp', b'WAVE': 'wav', b'AVI ': 'avi'}
+
+# Upload types grouped the way the routes accept them
+IMAGE_TYPES = {'png', 'jpeg', 'gif', 'bmp', 'tiff', 'webp'}
+AUDIO_TYPES = {'mp3', 'flac', 'ogg', 'wav', 'aac', 'm4a', 'mp4', 'webm'}
+VIDEO_TYPES = {'mp4', 'webm', 'avi'}
+
+
+def sniff(head):
+    if head[:4] == b'RIFF':
+        return RIFF_TYPES.get(head[8:12])
+    if head[4:8] == b'ftyp':
+        return 'm4a' if head[8:11] == b'M4A' else 'mp4'
+    for offset, magic, file_type in SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            return file_type
+    # MPEG audio frame sync without an ID3 tag, or ADTS framed AAC
+    if len(head) >= 2 and head[0] == 0xff and head[1] & 0xf6 == 0xf0:
+        return 'aac'
+    if len(head) >= 2 and head[0] == 0xff and head[1] & 0xe0 == 0xe0:
+        return 'mp3'
+    return None
+
+
+class UploadStream:
+    # File object werkzeug's form parser writes each uploaded file into. The bytes are
+    # hashed and sniffed as they arrive. Uploads up to spool_bytes stay in memory so they
+    # can be converted straight from the buffer; larger ones go to a temp file in the
+    # upload folder, so saving them is a rename rather than another full copy.
+
+    def __init__(self, folder, max_bytes=None, spool_bytes=0):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.spool_bytes = spool_bytes
+        self.path = None
+        self.size = 0
+        self.head = b''
+        self._hash = hashlib.sha256()
+        self._file = io.BytesIO() if spool_bytes else self._open_temp()
+        self._saved = False
+
+    def _open_temp(self):
+        self.path = os.path.join(self.folder, f'.{uuid.uuid4().hex}.part')
+        return open(self.path, 'w+b')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise RequestEntityTooLarge()
+        if len(self.head) < SNIFF_BYTES:
+            self.head += bytes(data[:SNIFF_BYTES - len(self.head)])
+        self._hash.update(data)
+        if self.in_memory and self.size > self.spool_bytes:
+            # Too big to keep in memory; continue on disk
+            spooled = self._file
+            self._file = self._open_temp()
+            self._file.write(spooled.getbuffer())
+        return self._file.write(data)
+
+    @property
+    def in_memory(self):
+        return self.path is None
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    @property
+    def file_type(self):
+        return sniff(self.head)
+
+    def getbuffer(self):
+        # Zero-copy view of an in-memory upload; release it before the stream is closed
+        return self._file.getbuffer()
+
+    def save(self, destination):
+        if self.in_memory:
+            with open(destination, 'wb') as f:
+                f.write(self._file.getbuffer())
+        else:
+            # Move the finished upload into place; no bytes are copied
+            self._file.close()
+            os.replace(self.path, destination)
+        self.path = destination
+        self._saved = True
+
+    def close(self):
+        self._file.close()
+        if self.path is not None and not self._saved:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def __getattr__(self, name):
+        # read, seek, tell, readline, ... come from the underlying file
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class StreamingUploadRequest(Request):
+    # Files of one request are parsed one after another, so when a file starts, the ones
+    # before it are complete. Each may stay in memory up to UPLOAD_SPOOL_BYTES, but only
+    # while the request as a whole holds less than UPLOAD_SPOOL_REQUEST_BYTES in memory;
+    # later files go straight to disk.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._upload_streams = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        config = current_app.config
+        spool_bytes = config.get('UPLOAD_SPOOL_BYTES', 0)
+        request_budget = config.get('UPLOAD_SPOOL_REQUEST_BYTES')
+        if request_budget is not None:
+            in_memory = sum(stream.size for stream in self._upload_streams if stream.in_memory)
+            spool_bytes = max(0, min(spool_bytes, request_budget - in_memory))
+        stream = UploadStream(config['UPLOAD_FOLDER'], config.get('MAX_CONTENT_LENGTH'), spool_bytes)
+        self._upload_streams.append(stream)
+        return stream
+
+
+class UploadInfo:
+    def __init__(self, path, size, sha256, file_type):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.file_type = file_type
+
+
+def save_upload(file_storage, destination):
+    # Returns an UploadInfo for the saved file. Uploads parsed by another request
+    # class fall back to a copy followed by a hashing pass.
+    stream = file_storage.stream
+    if isinstance(stream, UploadStream):
+        stream.save(destination)
+        return UploadInfo(destination, stream.size, stream.sha256, stream.file_type)
+
+    file_storage.save(destination)
+    digest = hashlib.sha256()
+    with open(destination, 'rb') as f:
+        head = f.read(SNIFF_BYTES)
+        digest.update(head)
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return UploadInfo(destination, os.path.getsize(destination), digest.hexdigest(), sniff(head))
@@ -1,85 +1,446 @@
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, send_from_directory, jsonify, Response, stream_with_context, g, abort
+import hashlib
 import os
-from pydub import AudioSegment
-import cv2
+import queue
+import threading
+import time
+import zipfile
+from collections import deque
+from functools import lru_cache
 from werkzeug.utils import secure_filename
-import fitz
+from jobs import JobQueue, JobStore
+from admission import Overloaded, build_limits
+from conversion_cache import ConversionCache, hash_file
+from outputs import ChunkBuffer, atomic_output
+from storage import Storage
+from metrics_store import MetricsStore
+from upload_stream import StreamingUploadRequest, UploadStream, save_upload, IMAGE_TYPES
+from backends import load_backend, prewarm
+from converters import (CONVERTERS, find_converter, run_converter, convert_image_derivatives,
+                        parse_derivative_targets, parse_page_ranges, batch_member_name, preset_name)
+from metrics import (Trace, TraceLog, stage, observe_stages, CONVERSION_SECONDS,
+                     REQUEST_SECONDS, UPLOAD_BYTES, CONVERTED_BYTES, RESPONSE_BYTES, CONVERSION_FAILURES)
 
 app = Flask(__name__)
+# Uploads are hashed and sniffed while werkzeug streams them to disk
+app.request_class = StreamingUploadRequest
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['CONVERTED_FOLDER'] = 'converted'
-
-# Ensure the upload and converted folders exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['CONVERTED_FOLDER'], exist_ok=True)
-
-def convert_pdf_to_docx(file_path):
+# Requests larger than this are rejected with 413 before or while they are read
+app.config['MAX_CONTENT_LENGTH'] = 512 * 1024 * 1024
+# Uploads up to this size stay in memory; small images are converted straight from the buffer
+app.config['UPLOAD_SPOOL_BYTES'] = 8 * 1024 * 1024
+# Larger images are converted in the pool even when they fit in memory (BGR needs 3 bytes a pixel)
+app.config['INLINE_MAX_PIXELS'] = 16 * 1000 * 1000
+# Most bytes of one request's files held in memory at once; further files are spooled to disk
+app.config['UPLOAD_SPOOL_REQUEST_BYTES'] = 16 * 1024 * 1024
+# Number of processes running conversions, sized apart from the HTTP workers
+app.config['CONVERSION_WORKERS'] = int(os.environ.get('CONVERSION_WORKERS', os.cpu_count() or 1))
+# Conversions of each kind allowed to run at once, and how many more may wait for a slot.
+# Anything beyond that is turned away with 429 and a Retry-After instead of queueing forever.
+app.config['CONVERSION_LIMITS'] = {
+    'image': {'concurrency': app.config['CONVERSION_WORKERS'], 'queue_size': 64},
+    'file': {'concurrency': max(1, app.config['CONVERSION_WORKERS'] // 2), 'queue_size': 16},
+    'audio': {'concurrency': max(1, app.config['CONVERSION_WORKERS'] // 2), 'queue_size': 16},
+    # PDF pages are rendered one job per page, so a single preview request may queue many
+    'raster': {'concurrency': app.config['CONVERSION_WORKERS'], 'queue_size': 256},
+    # A video job already spreads its segments over VIDEO_WORKERS encoders
+    'video': {'concurrency': 1, 'queue_size': 8},
+}
+# Seconds a request converting in-process (streams, in-memory images) waits for a slot before a 503
+app.config['ADMISSION_WAIT_TIMEOUT'] = 10
+# Files of one /batch handed to the worker pool at a time; the rest wait in the request
+# for a slot instead of being turned away. A batch with nothing in flight waits at most
+# BATCH_WAIT_TIMEOUT seconds for other clients' conversions to make room.
+app.config['BATCH_IN_FLIGHT'] = 2 * app.config['CONVERSION_WORKERS']
+app.config['BATCH_WAIT_TIMEOUT'] = 5 * 60
+# Quota for converted outputs; the least recently used are evicted beyond either cap
+app.config['CACHE_MAX_ENTRIES'] = 1000
+app.config['CACHE_MAX_BYTES'] = 1024 * 1024 * 1024
+# Uploads and outputs not used for these ages (seconds) expire. A background sweeper
+# checks every CLEANUP_INTERVAL seconds, reading the storage index rather than the folders.
+app.config['UPLOAD_MAX_AGE'] = 60 * 60
+app.config['CONVERTED_MAX_AGE'] = 24 * 60 * 60
+app.config['CLEANUP_INTERVAL'] = 10 * 60
+# Converted outputs never change once written, so clients and CDNs may keep them this long (seconds)
+app.config['DOWNLOAD_MAX_AGE'] = 365 * 24 * 60 * 60
+# PDFs with at least PDF_PARALLEL_MIN_PAGES pages are extracted by PDF_WORKERS processes. Each
+# running document conversion gets its share of the conversion pool rather than the whole
+# machine, so the 'file' slots together never start more processes than the pool has.
+app.config['PDF_WORKERS'] = int(os.environ.get(
+    'PDF_WORKERS', max(1, app.config['CONVERSION_WORKERS'] // app.config['CONVERSION_LIMITS']['file']['concurrency'])))
+app.config['PDF_PARALLEL_MIN_PAGES'] = 64
+# Most pages one /pdf/pages request may render
+app.config['PDF_RASTER_MAX_PAGES'] = 200
+# Videos of at least VIDEO_PARALLEL_MIN_SECONDS are cut at keyframes and the segments
+# encoded by VIDEO_WORKERS ffmpeg processes at once
+app.config['VIDEO_WORKERS'] = int(os.environ.get('VIDEO_WORKERS', os.cpu_count() or 1))
+app.config['VIDEO_PARALLEL_MIN_SECONDS'] = 60
+# Most outputs one /upload_image/derivatives request may ask for; they all share one image slot
+app.config['IMAGE_DERIVATIVES_MAX_TARGETS'] = 16
+# Images that would decode to more pixels than this are refused
+app.config['IMAGE_MAX_PIXELS'] = 250 * 1000 * 1000
+# Append one JSON line per request and per finished job, with stage timings, to this file
+app.config['TRACE_LOG'] = os.environ.get('TRACE_LOG')
+# Seconds between saves of each web worker's metrics for /metrics to add up
+app.config['METRICS_INTERVAL'] = 5
+# Converter backends each conversion worker imports when it starts (comma separated, empty for
+# none); the web process itself only imports a backend when it first converts in-process
+app.config['PREWARM_BACKENDS'] = os.environ.get('PREWARM_BACKENDS', 'image,pdf,raster,docx,audio,video')
+
+# Uploads are only ever expired: evicting one would pull the input from under its conversion
+uploads = Storage(app.config['UPLOAD_FOLDER'], max_age=app.config['UPLOAD_MAX_AGE'])
+converted = Storage(app.config['CONVERTED_FOLDER'], max_age=app.config['CONVERTED_MAX_AGE'],
+                    max_bytes=app.config['CACHE_MAX_BYTES'], max_entries=app.config['CACHE_MAX_ENTRIES'])
+# Pool workers import this module again as __mp_main__ when it is run directly (the
+# development server); only the serving process sweeps
+if __name__ != '__mp_main__':
+    uploads.start_sweeper(app.config['CLEANUP_INTERVAL'])
+    converted.start_sweeper(app.config['CLEANUP_INTERVAL'])
+
+# Job states are shared through the converted folder, so any web worker can answer for any job
+jobs = JobQueue(max_workers=app.config['CONVERSION_WORKERS'], initializer=prewarm,
+                initargs=([name for name in app.config['PREWARM_BACKENDS'].split(',') if name],),
+                store=JobStore(os.path.join(converted.folder, '.jobs.sqlite3'), max_age=app.config['CONVERTED_MAX_AGE']))
+limits = build_limits(app.config['CONVERSION_LIMITS'])
+# Every web worker saves its metrics next to the job states, and /metrics reports their
+# sum; samples of other workers lag by up to METRICS_INTERVAL seconds
+metrics_store = MetricsStore(os.path.join(converted.folder, '.metrics.sqlite3'), interval=app.config['METRICS_INTERVAL'])
+if __name__ != '__mp_main__':
+    metrics_store.start()
+cache = ConversionCache(converted)
+trace_log = TraceLog(app.config['TRACE_LOG']) if app.config['TRACE_LOG'] else None
+
+def hold_slot(kind, file_path, response_factory):
+    # Wait for a conversion slot, then build a streaming response that keeps the slot
+    # until the response is closed
+    limit = limits[kind]
     try:
-        pdf_document = fitz.open(file_path)
-        text = ""
-        for page_number in range(pdf_document.page_count):
-            page = pdf_document.load_page(page_number)
-            text += page.get_text()
-
-        converted_file_path = os.path.join(app.config['CONVERTED_FOLDER'], 'converted.docx')
-        with open(converted_file_path, 'w', encoding='utf-8') as docx_file:
-            docx_file.write(text)
-
-        return 'converted.docx'
-    except Exception as e:
-        print(f"Error converting PDF to DOCX: {e}")
-        return None
-
-def convert_docx_to_pdf(file_path):
+        limit.acquire(app.config['ADMISSION_WAIT_TIMEOUT'])
+    except Overloaded:
+        uploads.discard(file_path)
+        raise
+    start = time.monotonic()
     try:
-        # Use the appropriate library or tool for converting DOCX to PDF
-        # For example, you can use python-docx2pdf
-        import docx2pdf
-        converted_file_path = os.path.join(app.config['CONVERTED_FOLDER'], 'converted.pdf')
-        docx2pdf.convert(file_path, converted_file_path)
-        return 'converted.pdf'
-    except Exception as e:
-        print(f"Error converting DOCX to PDF: {e}")
-        return None
-
-
-def convert_image(file_path, output_format):
+        response = response_factory()
+    except BaseException:
+        limit.release()
+        raise
+    response.call_on_close(lambda: limit.release(time.monotonic() - start))
+    return response
+
+def download_name(filename, output_format):
+    return (os.path.splitext(secure_filename(filename))[0] or 'converted') + f'.{output_format}'
+
+def stream_conversion(converter, file_path, filename, output_format, options):
+    # Send the output while it is still being produced (DOCX page by page, audio as ffmpeg encodes)
+    # The request is recorded as soon as the response starts, so the conversion keeps its own trace
+    def generate():
+        status = 'failed'
+        output_bytes = 0
+        uploads.hold(file_path)
+        with Trace() as trace:
+            try:
+                for chunk in converter.stream(file_path, output_format, **options):
+                    output_bytes += len(chunk)
+                    yield chunk
+                status = 'done'
+            except Exception as e:
+                print(f"Error converting {converter.name}: {e}")
+            finally:
+                uploads.discard(file_path)
+                observe_stages(trace.stages)
+                record_conversion(converter.kind, status, trace.elapsed(), output_bytes)
+
+    return hold_slot(converter.kind, file_path, lambda: Response(
+        stream_with_context(generate()), mimetype=converter.mimetypes[output_format],
+        headers={'Content-Disposition': f'attachment; filename={download_name(filename, output_format)}'}))
+
+def wants_json():
+    best = request.accept_mimetypes.best_match(['application/json', 'text/html'])
+    return best == 'application/json' and request.accept_mimetypes[best] > request.accept_mimetypes['text/html']
+
+def responds_json():
+    # /convert is the API route and always answers in JSON, errors and accepted jobs alike;
+    # the form routes only do so for clients that ask for it
+    return request.endpoint == 'convert' or wants_json()
+
+def receive_upload(file_storage):
+    file_path = uploads.new_path(secure_filename(file_storage.filename))
+    with stage('upload_save'):
+        upload = save_upload(file_storage, file_path)
+    uploads.record(file_path, upload.size)
+    UPLOAD_BYTES.inc(upload.size, file_type=upload.file_type or 'unknown')
+    return upload
+
+def invalid_upload(upload):
+    uploads.discard(upload.path)
+    if responds_json():
+        return jsonify(error="Unsupported file type"), 415
+    return render_template('error.html', title='EditMonk', message="Unsupported file type"), 415
+
+@lru_cache(maxsize=1024)
+def file_etag(file_path, mtime_ns, size):
+    # mtime and size are part of the cache key so a replaced file is hashed again
+    return hash_file(file_path)
+
+def send_output(filename, download_name=None):
+    # Serve a converted file with a strong ETag (sha256 of its bytes) and long-lived
+    # immutable caching. send_file answers If-None-Match with 304 and Range/If-Range
+    # requests with 206, so interrupted downloads resume instead of starting over.
+    file_path = converted.path(filename)
+    if file_path is None or not os.path.isfile(file_path):
+        abort(404)
+    etag = cache.content_hash(filename)
+    if etag is None:
+        stat = os.stat(file_path)
+        etag = file_etag(file_path, stat.st_mtime_ns, stat.st_size)
+    converted.touch(filename)
+    response = send_from_directory(converted.folder, os.path.relpath(file_path, converted.folder), as_attachment=True,
+                                   download_name=download_name or filename, etag=etag, conditional=True,
+                                   max_age=app.config['DOWNLOAD_MAX_AGE'])
+    response.cache_control.immutable = True
+    return response
+
+def conversion_key(name, output_format, options, content_hash):
+    return cache.key(None, output_format, {'converter': name, 'options': options}, content_hash=content_hash)
+
+def converter_settings(converter, options):
+    # Server-side settings a converter asked for, added to the options parsed from the request
+    settings = {
+        'max_pixels': app.config['IMAGE_MAX_PIXELS'],
+        'workers': app.config['PDF_WORKERS'],
+        'parallel_min_pages': app.config['PDF_PARALLEL_MIN_PAGES'],
+        'video_workers': app.config['VIDEO_WORKERS'],
+        'parallel_min_seconds': app.config['VIDEO_PARALLEL_MIN_SECONDS'],
+    }
+    return dict(options, **{name: settings[name] for name in converter.settings})
+
+def converts_in_memory(file_storage):
+    # Uploads still held in memory are converted in the request unless the client asked for a
+    # job. A small file can still be a huge image, so images decoding to more than
+    # INLINE_MAX_PIXELS (or of unknown size) go to the pool instead of the web worker.
+    stream = file_storage.stream
+    in_memory = isinstance(stream, UploadStream) and stream.in_memory
+    if not in_memory or not (request.form.get('inline') or not wants_json()):
+        return False
+    if stream.file_type not in IMAGE_TYPES:
+        return True
+    with stream.getbuffer() as view:
+        size = load_backend('image').image_size(view)
+    return size is not None and size[0] * size[1] <= app.config['INLINE_MAX_PIXELS']
+
+def convert_from_memory(converter, file_storage, output_format, options=None):
+    # Convert straight from the upload buffer and answer with the output bytes;
+    # nothing touches the disk and the client needs no redirect
+    stream = file_storage.stream
+    UPLOAD_BYTES.inc(stream.size, file_type=stream.file_type or 'unknown')
+    if options is None:
+        options = converter.parse_options(request.form)
+    name = download_name(file_storage.filename, output_format)
+    cache_key = conversion_key(converter.name, output_format, options, stream.sha256)
+    cached_file = cache.get(cache_key)
+    if cached_file:
+        return send_output(cached_file, download_name=name)
+
+    started = time.monotonic()
     try:
-        # Read the image using OpenCV
-        image = cv2.imread(file_path)
-
-        # Convert the image to the desired format
-        _, buffer = cv2.imencode(f".{output_format}", image)
-        converted_file_path = os.path.join(app.config['CONVERTED_FOLDER'], f'converted.{output_format}')
-        with open(converted_file_path, 'wb') as image_file:
-            image_file.write(buffer)
-
-        return f'converted.{output_format}'
+        with limits[converter.kind].slot(app.config['ADMISSION_WAIT_TIMEOUT']):
+            with stream.getbuffer() as view:
+                data = converter.convert_buffer(view, output_format, **converter_settings(converter, options))
+    except Overloaded:
+        raise
     except Exception as e:
-        print(f"Error converting image: {e}")
-        return None
-
-def convert_audio(file_path, output_format):
+        print(f"Error converting {converter.name}: {e}")
+        record_conversion(converter.kind, 'failed', time.monotonic() - started)
+        if responds_json():
+            return jsonify(error=f"Error converting {converter.kind}"), 500
+        return render_template('error.html', title='EditMonk', message=f"Error converting {converter.kind}")
+
+    record_conversion(converter.kind, 'done', time.monotonic() - started, len(data))
+    response = Response(data, mimetype=converter.mimetypes[output_format],
+                        headers={'Content-Disposition': f'attachment; filename={name}'})
+    # The output is cached once it has been sent, so the client does not wait for the disk
+    response.call_on_close(lambda: cache_output(cache_key, data, output_format))
+    return response
+
+def cache_output(cache_key, data, output_format):
+    # Keep an output converted in the request, so the next identical upload is served from the cache
     try:
-        # Read the audio using pydub
-        audio = AudioSegment.from_file(file_path)
-
-        # Convert the audio to MP3
-        if output_format == 'mp3':
-            converted_file_path = os.path.join(app.config['CONVERTED_FOLDER'], 'converted.mp3')
-            audio.export(converted_file_path, format='mp3')
-            return 'converted.mp3'
-        else:
-            raise ValueError(f"Unsupported audio format: {output_format}")
+        with atomic_output(converted.folder, output_format) as output:
+            with open(output.path, 'wb') as output_file:
+                output_file.write(data)
+        cache.put(cache_key, output.final_path, sha256=hashlib.sha256(data).hexdigest())
+    except OSError as e:
+        print(f"Error caching conversion: {e}")
+
+def submit_conversion(kind, output_format, cache_key, upload, func, *args, on_complete=None, keep_upload=False):
+    # Skip the converter entirely when the same bytes were already converted the same way.
+    # With keep_upload the caller removes the upload itself, e.g. when several jobs share it.
+    file_path = upload.path
+    cached_file = cache.get(cache_key)
+    if cached_file:
+        if not keep_upload:
+            uploads.discard(file_path)
+        job = jobs.completed(kind, output_format, cached_file)
+        if on_complete is not None:
+            on_complete(job)
+        return job
+
+    # The input must not expire while the job waits for a slot or runs
+    uploads.hold(file_path)
+
+    def store_result(job):
+        # The upload is no longer needed once its conversion has finished
+        uploads.release(file_path)
+        if not keep_upload:
+            uploads.discard(file_path)
+        if job.result:
+            job.result = cache.put(cache_key, os.path.join(app.config['CONVERTED_FOLDER'], job.result))
+        record_job(job)
+        if on_complete is not None:
+            on_complete(job)
 
-    except Exception as e:
-        print(f"Error converting audio: {e}")
-        return None
+    try:
+        return jobs.submit(kind, output_format, func, file_path, *args, on_complete=store_result, limit=limits.get(kind))
+    except Overloaded:
+        uploads.release(file_path)
+        if not keep_upload:
+            uploads.discard(file_path)
+        raise
+
+def remove_after(file_path, count):
+    # A callback that removes a shared upload the count-th time it is called
+    remaining = [count]
+    lock = threading.Lock()
+
+    def done(job=None):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            uploads.discard(file_path)
+
+    return done
+
+def record_conversion(kind, status, seconds, output_bytes=0):
+    # The same metrics for every conversion, whether it ran as a job or in the request
+    CONVERSION_SECONDS.observe(seconds, kind=kind, status=status)
+    if status == 'done':
+        CONVERTED_BYTES.inc(output_bytes, kind=kind)
+    else:
+        CONVERSION_FAILURES.inc(kind=kind)
+
+def record_job(job):
+    # Stage timings measured in the worker process are added to this process's histograms
+    status = 'failed' if job.error or not job.result else 'done'
+    seconds = time.time() - job.created
+    observe_stages(job.stages)
+    output_bytes = os.path.getsize(converted.path(job.result)) if job.result else 0
+    record_conversion(job.kind, status, seconds, output_bytes)
+    if trace_log is not None:
+        trace_log.write({'time': time.time(), 'job': job.id, 'kind': job.kind, 'format': job.output_format,
+                         'status': status, 'seconds': round(seconds, 6), 'stages': job.stages})
+
+def dispatch(file_storage, output_format, kinds=None):
+    # The one path every conversion takes: the upload's sniffed type and the target format
+    # pick a converter from the registry, then the cheapest path it supports is used -
+    # straight from an upload still in memory, streamed while converting when the client
+    # asked for stream=1, or otherwise as a job in the worker pool
+    stream = file_storage.stream
+    if converts_in_memory(file_storage):
+        converter = find_converter(stream.file_type, output_format, kinds)
+        if converter is not None and converter.convert_buffer is not None:
+            return convert_from_memory(converter, file_storage, output_format)
+
+    upload = receive_upload(file_storage)
+    converter = find_converter(upload.file_type, output_format, kinds)
+    if converter is None:
+        return invalid_upload(upload)
+    options = converter.parse_options(request.form)
+    if request.form.get('stream') and converter.stream is not None:
+        return stream_conversion(converter, upload.path, file_storage.filename, output_format,
+                                 converter_settings(converter, options))
+
+    cache_key = conversion_key(converter.name, output_format, options, upload.sha256)
+    job = submit_conversion(converter.kind, output_format, cache_key, upload, run_converter, converter.name,
+                            app.config['CONVERTED_FOLDER'], output_format, converter_settings(converter, options))
+    return job_accepted(job)
+
+def invalid_format():
+    return render_template('error.html', title='EditMonk', message="Invalid conversion format")
+
+def kind_targets(kind):
+    return {target for converter in CONVERTERS.values() if converter.kind == kind for target in converter.targets}
+
+def job_accepted(job):
+    # Hand the job id back at once; the conversion runs in the worker pool
+    if responds_json():
+        response = jsonify(job_info(job))
+        response.status_code = 202
+        response.headers['Location'] = url_for('job_status', job_id=job.id)
+        return response
+    return redirect(url_for('job_status', job_id=job.id))
+
+def job_info(job):
+    info = job.to_dict()
+    info['status_url'] = url_for('job_status', job_id=job.id)
+    info['result_url'] = url_for('job_result', job_id=job.id)
+    return info
+
+@app.before_request
+def start_trace():
+    g.trace = Trace().start()
+
+@app.after_request
+def record_request(response):
+    trace = g.get('trace')
+    if trace is None:
+        return response
+    endpoint = request.endpoint or 'unknown'
+    seconds = trace.elapsed()
+    observe_stages(trace.stages)
+    REQUEST_SECONDS.observe(seconds, endpoint=endpoint, status=response.status_code)
+    if response.content_length:
+        RESPONSE_BYTES.inc(response.content_length, endpoint=endpoint)
+    if trace_log is not None:
+        trace_log.write({'time': time.time(), 'method': request.method, 'path': request.path,
+                         'status': response.status_code, 'seconds': round(seconds, 6),
+                         'bytes_in': request.content_length, 'bytes_out': response.content_length,
+                         'stages': trace.stages})
+    return response
+
+@app.teardown_request
+def stop_trace(exc):
+    trace = g.pop('trace', None)
+    if trace is not None:
+        trace.stop()
+
+@app.route('/metrics')
+def metrics():
+    return Response(metrics_store.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
     return render_template('index.html', title='EditMonk')
 
+@app.route('/convert', methods=['POST'])
+def convert():
+    # Any supported conversion: POST file=<upload> format=<target>, plus the converter's options
+    uploaded_file = request.files.get('file')
+    if uploaded_file is None or uploaded_file.filename == '':
+        return jsonify(error="No file uploaded"), 400
+    if not any(request.form.get('format') in converter.targets for converter in CONVERTERS.values()):
+        return jsonify(error="Invalid conversion format"), 400
+    return dispatch(uploaded_file, request.form['format'])
+
+@app.route('/converters')
+def list_converters():
+    return jsonify(converters=[converter.to_dict() for converter in CONVERTERS.values()])
+
+# The per-media routes below are kept for the existing forms and clients; each one only
+# maps its form onto dispatch()
+
 @app.route('/upload_file', methods=['GET', 'POST'])
 def upload_file():
     if request.method == 'POST':
@@ -91,24 +452,11 @@ def upload_file():
         if uploaded_file.filename == '':
             return redirect(request.url)
 
-        if uploaded_file:
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(uploaded_file.filename))
-            uploaded_file.save(file_path)
-
-            # Choose the conversion format based on user input
-            conversion_format = request.form['format']
-            if conversion_format == 'doc':
-                # Add the conversion logic for DOC to PDF if needed
-                converted_file = convert_docx_to_pdf(file_path)
-            elif conversion_format == 'pdf':
-                converted_file = convert_pdf_to_docx(file_path)
-            else:
-                return render_template('error.html', title='EditMonk', message="Invalid conversion format")
-
-            if converted_file:
-                return redirect(url_for('download_file', filename=converted_file))
-            else:
-                return render_template('error.html', title='EditMonk', message="Error converting file")
+        # "doc" converts a Word document to PDF, "pdf" converts a PDF to DOCX
+        output_format = {'doc': 'pdf', 'pdf': 'docx'}.get(request.form['format'])
+        if output_format is None:
+            return invalid_format()
+        return dispatch(uploaded_file, output_format, kinds={'file'})
 
     return render_template('upload_file.html', title='EditMonk')
 
@@ -123,21 +471,9 @@ def upload():
     if file.filename == '':
         return redirect(request.url)
 
-    if file:
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(file.filename))
-        file.save(file_path)
-
-        # Choose the conversion format based on user input
-        conversion_format = request.form['format']
-        if conversion_format in ['jpeg', 'png', 'webp']:
-            converted_file = convert_image(file_path, conversion_format)
-        else:
-            return render_template('error.html', title='EditMonk', message="Invalid conversion format")
-
-        if converted_file:
-            return redirect(url_for('download_image', filename=converted_file))
-        else:
-            return render_template('error.html', title='EditMonk', message="Error converting image")
+    if request.form['format'] not in kind_targets('image'):
+        return invalid_format()
+    return dispatch(file, request.form['format'], kinds={'image'})
 
 @app.route('/upload_audio', methods=['GET', 'POST'])
 def upload_audio():
@@ -150,21 +486,9 @@ def upload_audio():
         if audio.filename == '':
             return redirect(request.url)
 
-        if audio:
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(audio.filename))
-            audio.save(file_path)
-
-            # Choose the conversion format based on user input
-            conversion_format = request.form['format']
-            if conversion_format == 'mp3':
-                converted_file = convert_audio(file_path, conversion_format)
-            else:
-                return render_template('error.html', title='EditMonk', message="Invalid conversion format")
-
-            if converted_file:
-                return redirect(url_for('download_audio', filename=converted_file))
-            else:
-                return render_template('error.html', title='EditMonk', message="Error converting audio")
+        if request.form['format'] not in kind_targets('audio'):
+            return invalid_format()
+        return dispatch(audio, request.form['format'], kinds={'audio'})
 
     return render_template('upload_audio.html', title='EditMonk')
 
@@ -179,31 +503,264 @@ def upload_image():
         if image.filename == '':
             return redirect(request.url)
 
-        if image:
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(image.filename))
-            image.save(file_path)
+        if request.form['format'] not in kind_targets('image'):
+            return invalid_format()
+        return dispatch(image, request.form['format'], kinds={'image'})
 
-            # Choose the conversion format based on user input
-            conversion_format = request.form['format']
-            if conversion_format in ['jpeg', 'png', 'webp']:
-                converted_file = convert_image(file_path, conversion_format)
-            else:
-                return render_template('error.html', title='EditMonk', message="Invalid conversion format")
+    return render_template('upload_image.html', title='EditMonk')
 
-            if converted_file:
-                return redirect(url_for('download_image', filename=converted_file))
-            else:
-                return render_template('error.html', title='EditMonk', message="Error converting image")
+@app.route('/upload_video', methods=['GET', 'POST'])
+def upload_video():
+    if request.method == 'POST':
+        if 'video' not in request.files:
+            return redirect(request.url)
 
-    return render_template('upload_image.html', title='EditMonk')
+        video = request.files['video']
+
+        if video.filename == '':
+            return redirect(request.url)
+
+        if request.form['format'] not in kind_targets('video'):
+            return invalid_format()
+        return dispatch(video, request.form['format'], kinds={'video'})
+
+    return render_template('upload_video.html', title='EditMonk')
+
+@app.route('/upload_image/derivatives', methods=['POST'])
+def upload_image_derivatives():
+    # One upload, many outputs: targets="jpeg:320:80,png:1024,webp:640:75" (format:max size:quality),
+    # optionally with preset=fast|small|lossless for all of them
+    image = request.files.get('image')
+    if image is None or image.filename == '':
+        return jsonify(error="No image uploaded"), 400
+    try:
+        targets = parse_derivative_targets(request.form.get('targets', ''))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    if len(targets) > app.config['IMAGE_DERIVATIVES_MAX_TARGETS']:
+        return jsonify(error=f"At most {app.config['IMAGE_DERIVATIVES_MAX_TARGETS']} targets per request"), 400
+
+    upload = receive_upload(image)
+    if upload.file_type not in IMAGE_TYPES:
+        return invalid_upload(upload)
+    preset = request.form.get('preset', type=preset_name)
+    cache_key = conversion_key('image_derivatives', 'zip', {'targets': targets, 'preset': preset}, upload.sha256)
+    job = submit_conversion('image', 'zip', cache_key, upload, convert_image_derivatives, app.config['CONVERTED_FOLDER'],
+                            targets, preset, app.config['IMAGE_MAX_PIXELS'])
+    return job_accepted(job)
+
+@app.route('/pdf/pages', methods=['POST'])
+def pdf_pages():
+    # Page previews: file=<pdf> pages="1-3,7,10-" (default the first page) format=png|webp|jpeg,
+    # with optional dpi and preset. Each page is its own job and its own cache entry, so pages
+    # render in parallel across the worker pool, a page rendered once is never rendered again,
+    # and the first page is ready as soon as it alone has been rendered. A single page of an
+    # upload still in memory is rendered in the request and sent back directly.
+    document = request.files.get('file')
+    if document is None or document.filename == '':
+        return jsonify(error="No file uploaded"), 400
+    converter = CONVERTERS['pdf_pages']
+    output_format = request.form.get('format', 'png')
+    if output_format not in converter.targets:
+        return jsonify(error="Invalid conversion format"), 400
+    spec = request.form.get('pages', '1').strip()
+    options = converter.parse_options(request.form)
+    options.pop('page', None)
+
+    if spec.isdigit() and document.stream.file_type == 'pdf' and converts_in_memory(document):
+        return convert_from_memory(converter, document, output_format, dict(options, page=int(spec)))
+
+    upload = receive_upload(document)
+    if upload.file_type != 'pdf':
+        return invalid_upload(upload)
+    try:
+        with stage('pdf_open'):
+            page_count = load_backend('pdf').page_count(upload.path)
+        pages = parse_page_ranges(spec, page_count)
+    except ValueError as e:
+        uploads.discard(upload.path)
+        return jsonify(error=str(e)), 400
+    except Exception as e:
+        print(f"Error opening PDF: {e}")
+        return invalid_upload(upload)
+    if len(pages) > app.config['PDF_RASTER_MAX_PAGES']:
+        uploads.discard(upload.path)
+        return jsonify(error=f"At most {app.config['PDF_RASTER_MAX_PAGES']} pages per request"), 400
+
+    page_done = remove_after(upload.path, len(pages))
+    results = []
+    for page in pages:
+        page_options = dict(options, page=page)
+        cache_key = conversion_key(converter.name, output_format, page_options, upload.sha256)
+        try:
+            job = submit_conversion(converter.kind, output_format, cache_key, upload, run_converter, converter.name,
+                                    app.config['CONVERTED_FOLDER'], output_format,
+                                    converter_settings(converter, page_options), on_complete=page_done, keep_upload=True)
+        except Overloaded:
+            # Pages already queued still finish (and are cached); the rest are dropped
+            for _ in range(len(pages) - len(results)):
+                page_done()
+            raise
+        results.append(dict(job_info(job), page=page))
+
+    response = jsonify(page_count=page_count, pages=results)
+    response.status_code = 202
+    return response
 
 @app.route('/download_image/<filename>')
 def download_image(filename):
-    return send_from_directory(app.config['CONVERTED_FOLDER'], filename, as_attachment=True)
+    return send_output(filename)
 
 @app.route('/download_audio/<filename>')
 def download_audio(filename):
-    return send_from_directory(app.config['CONVERTED_FOLDER'], filename, as_attachment=True)
+    return send_output(filename)
+
+@app.route('/download_file/<filename>')
+def download_file(filename):
+    return send_output(filename)
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    # Convert the uploaded files in the worker pool, BATCH_IN_FLIGHT at a time, and stream back
+    # a ZIP that grows as each conversion finishes. One format applies to all files, or give
+    # one per file.
+    files = [f for f in request.files.getlist('files') if f.filename]
+    formats = request.form.getlist('format')
+    if not files:
+        return jsonify(error="No files uploaded"), 400
+    if len(formats) == 1:
+        formats = formats * len(files)
+    if len(formats) != len(files):
+        return jsonify(error="Give one format, or one format per file"), 400
+
+    finished = queue.Queue()
+    names = {}
+    errors = []
+    tasks = []
+    for uploaded_file, output_format in zip(files, formats):
+        upload = receive_upload(uploaded_file)
+        converter = find_converter(upload.file_type, output_format)
+        if converter is None:
+            uploads.discard(upload.path)
+            errors.append(f"{uploaded_file.filename}: cannot convert {upload.file_type or 'unknown'} file to {output_format}")
+            continue
+        # Options such as preset apply to every file whose converter understands them
+        tasks.append((uploaded_file.filename, upload, converter, output_format, converter.parse_options(request.form)))
+
+    def submit(task):
+        filename, upload, converter, output_format, options = task
+
+        def done(job):
+            uploads.discard(upload.path)
+            finished.put(job)
+
+        # The upload is kept if the queue is full, so the file can be submitted again later
+        cache_key = conversion_key(converter.name, output_format, options, upload.sha256)
+        job = submit_conversion(converter.kind, output_format, cache_key, upload, run_converter, converter.name,
+                                app.config['CONVERTED_FOLDER'], output_format, converter_settings(converter, options),
+                                on_complete=done, keep_upload=True)
+        names[job.id] = filename
+
+    def generate():
+        buffer = ChunkBuffer()
+        used_names = set()
+        waiting = deque(tasks)
+        in_flight = 0
+        # Files waiting their turn must not expire either
+        for task in tasks:
+            uploads.hold(task[1].path)
+        deadline = time.monotonic() + app.config['BATCH_WAIT_TIMEOUT']
+        try:
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+                while waiting or in_flight:
+                    while waiting and in_flight < app.config['BATCH_IN_FLIGHT']:
+                        try:
+                            submit(waiting[0])
+                        except Overloaded as e:
+                            # A full queue holds the batch back until one of its own files finishes
+                            if in_flight:
+                                break
+                            if time.monotonic() < deadline:
+                                time.sleep(min(e.retry_after, 1))
+                                continue
+                            filename, upload = waiting.popleft()[:2]
+                            uploads.discard(upload.path)
+                            errors.append(f"{filename}: {e}")
+                            continue
+                        waiting.popleft()
+                        in_flight += 1
+                        deadline = time.monotonic() + app.config['BATCH_WAIT_TIMEOUT']
+                    if not in_flight:
+                        continue
+
+                    job = finished.get()
+                    in_flight -= 1
+                    deadline = time.monotonic() + app.config['BATCH_WAIT_TIMEOUT']
+                    if not job.result:
+                        errors.append(f"{names[job.id]}: {job.error}")
+                        continue
+                    arcname = batch_member_name(names[job.id], job.output_format, used_names)
+                    with open(converted.path(job.result), 'rb') as src:
+                        with archive.open(arcname, 'w', force_zip64=True) as dest:
+                            for chunk in iter(lambda: src.read(1024 * 1024), b''):
+                                dest.write(chunk)
+                                yield buffer.drain()
+                    yield buffer.drain()
+                if errors:
+                    archive.writestr('errors.txt', '\n'.join(errors) + '\n')
+            yield buffer.drain()
+        finally:
+            # Files never submitted, e.g. when the client went away
+            for task in waiting:
+                uploads.discard(task[1].path)
+
+    return Response(stream_with_context(generate()), mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename=converted.zip'})
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    if responds_json():
+        return jsonify(error="File is too large"), 413
+    return render_template('error.html', title='EditMonk', message="File is too large"), 413
+
+@app.errorhandler(Overloaded)
+def overloaded(e):
+    # Shed load quickly; clients are told when a retry is likely to get a slot
+    if responds_json():
+        response = jsonify(error=str(e), retry_after=e.retry_after)
+        response.status_code = e.status
+    else:
+        response = app.make_response((render_template('error.html', title='EditMonk', message=str(e)), e.status))
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        if wants_json():
+            return jsonify(error="Unknown job"), 404
+        return render_template('error.html', title='EditMonk', message="Unknown job"), 404
+
+    if wants_json():
+        return jsonify(job_info(job))
+    return render_template('job.html', title='EditMonk', job=job)
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify(error="Unknown job"), 404
+    if job.finished is None:
+        response = jsonify(job_info(job))
+        response.status_code = 202
+        response.headers['Retry-After'] = '1'
+        return response
+    if job.error:
+        return jsonify(job_info(job)), 500
+
+    return send_output(job.result)
 
 if __name__ == '__main__':
+    # Development server; serve.py runs the app in production
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,146 @@
+import glob
+import os
+import re
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from audio_stream import ffmpeg_binary, run_ffmpeg
+from metrics import stage
+
+# ffmpeg options for each target container: the muxer, how video and audio are encoded,
+# and the codecs that may be copied into it unchanged (None: the container takes any)
+VIDEO_FORMATS = {
+    'mp4': {
+        'muxer': ['-f', 'mp4', '-movflags', '+faststart'],
+        'video': ['-codec:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p'],
+        'audio': ['-codec:a', 'aac', '-b:a', '160k'],
+        'copy_video': {'h264', 'hevc'},
+        'copy_audio': {'aac', 'mp3'},
+    },
+    'webm': {
+        'muxer': ['-f', 'webm'],
+        'video': ['-codec:v', 'libvpx-vp9', '-deadline', 'realtime', '-cpu-used', '8', '-crf', '32', '-b:v', '0'],
+        'audio': ['-codec:a', 'libopus', '-b:a', '96k'],
+        'copy_video': {'vp8', 'vp9', 'av1'},
+        'copy_audio': {'opus', 'vorbis'},
+    },
+    'mkv': {
+        'muxer': ['-f', 'matroska'],
+        'video': ['-codec:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p'],
+        'audio': ['-codec:a', 'aac', '-b:a', '160k'],
+        'copy_video': None,
+        'copy_audio': None,
+    },
+}
+
+VIDEO_MIMETYPES = {
+    'mp4': 'video/mp4',
+    'webm': 'video/webm',
+    'mkv': 'video/x-matroska',
+}
+
+# auto copies the streams when the target takes their codecs and transcodes otherwise
+VIDEO_MODES = ('auto', 'remux', 'transcode')
+
+# Each worker gets a couple of segments so one slow segment does not hold up the rest,
+# but segments stay long enough that starting an encoder costs little next to the encode
+SEGMENTS_PER_WORKER = 2
+MIN_SEGMENT_SECONDS = 4
+
+STREAM_PATTERN = re.compile(r'Stream #\d+:\d+\S*: (Video|Audio): (\w+)')
+DURATION_PATTERN = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+
+
+def probe(file_path):
+    # (video codec, audio codec, duration in seconds) of the first video and audio streams,
+    # any of them None when missing. Read from ffmpeg's own description of its input, so
+    # nothing beyond the ffmpeg binary is needed.
+    command = [ffmpeg_binary(), '-nostdin', '-hide_banner', '-i', file_path]
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    report = result.stderr.decode('utf-8', 'replace')
+    codecs = {}
+    for line in report.splitlines():
+        match = STREAM_PATTERN.search(line)
+        # Cover art is reported as a video stream
+        if match is not None and '(attached pic)' not in line:
+            codecs.setdefault(match.group(1), match.group(2))
+    if not codecs:
+        raise ValueError(report.strip().splitlines()[-1] if report.strip() else 'No audio or video streams')
+    seconds = None
+    duration = DURATION_PATTERN.search(report)
+    if duration is not None:
+        seconds = int(duration.group(1)) * 3600 + int(duration.group(2)) * 60 + float(duration.group(3))
+    return codecs.get('Video'), codecs.get('Audio'), seconds
+
+
+def can_remux(output_format, video, audio):
+    options = VIDEO_FORMATS[output_format]
+    return all(codec is None or allowed is None or codec in allowed
+               for codec, allowed in ((video, options['copy_video']), (audio, options['copy_audio'])))
+
+
+def stream_maps(video, audio):
+    return (['-map', '0:v:0'] if video else []) + (['-map', '0:a:0'] if audio else [])
+
+
+def transcode(file_path, output_path, output_format, mode='auto', workers=1, parallel_min_seconds=60):
+    # Remux when possible (or asked to), otherwise transcode; clips of at least
+    # parallel_min_seconds are cut into segments that `workers` encoders work on at once
+    if output_format not in VIDEO_FORMATS:
+        raise ValueError(f"Unsupported video format: {output_format}")
+    if mode not in VIDEO_MODES:
+        raise ValueError(f"Unknown video mode: {mode}")
+    options = VIDEO_FORMATS[output_format]
+    video, audio, duration = probe(file_path)
+
+    if mode == 'remux' or (mode == 'auto' and can_remux(output_format, video, audio)):
+        with stage('video_remux'):
+            run_ffmpeg(['-i', file_path, *stream_maps(video, audio), '-codec', 'copy', *options['muxer'], output_path])
+        return
+
+    if video is None or workers < 2 or duration is None or duration < parallel_min_seconds:
+        with stage('video_transcode'):
+            run_ffmpeg(['-i', file_path, *stream_maps(video, audio), *(options['video'] if video else []),
+                        *(options['audio'] if audio else []), *options['muxer'], output_path])
+        return
+
+    transcode_segments(file_path, output_path, output_format, audio is not None, duration, workers)
+
+
+def transcode_segments(file_path, output_path, output_format, has_audio, duration, workers):
+    # Cut the video stream at keyframes without decoding it, encode the pieces in parallel
+    # (the audio track is encoded whole alongside them, so there are no gaps at the cuts),
+    # then join everything with stream copy
+    options = VIDEO_FORMATS[output_format]
+    segment_seconds = max(MIN_SEGMENT_SECONDS, duration / (workers * SEGMENTS_PER_WORKER))
+    threads = str(max(1, (os.cpu_count() or 1) // workers))
+    with tempfile.TemporaryDirectory() as folder:
+        with stage('video_split'):
+            run_ffmpeg(['-i', file_path, '-map', '0:v:0', '-codec', 'copy', '-f', 'segment',
+                        '-segment_time', f'{segment_seconds:.3f}', '-reset_timestamps', '1',
+                        os.path.join(folder, 'source%05d.mkv')])
+        sources = sorted(glob.glob(os.path.join(folder, 'source*.mkv')))
+        encoded = [os.path.join(folder, f'encoded{number:05d}.mkv') for number in range(len(sources))]
+        audio_path = os.path.join(folder, 'audio.mka')
+
+        with stage('video_encode'), ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_ffmpeg, ['-i', source, '-map', '0:v:0', *options['video'],
+                                                    '-threads', threads, target])
+                       for source, target in zip(sources, encoded)]
+            if has_audio:
+                futures.append(executor.submit(run_ffmpeg, ['-i', file_path, '-map', '0:a:0', *options['audio'],
+                                                            audio_path]))
+            for future in futures:
+                future.result()
+
+        segment_list = os.path.join(folder, 'segments.txt')
+        with open(segment_list, 'w', encoding='utf-8') as list_file:
+            list_file.writelines(f"file '{path}'\n" for path in encoded)
+        inputs = ['-f', 'concat', '-safe', '0', '-i', segment_list]
+        maps = ['-map', '0:v:0']
+        if has_audio:
+            inputs += ['-i', audio_path]
+            maps += ['-map', '1:a:0']
+        with stage('video_concat'):
+            run_ffmpeg([*inputs, *maps, '-codec', 'copy', *options['muxer'], output_path])